@@ -0,0 +1,125 @@
+"""
+Memory/throughput benchmark: `ChunkBuffer` vs the previous `str` buffer on multi-kilobyte streamed responses.
+
+Run: python -m benchmarks.chunk_buffer
+"""
+import json
+import re
+import time
+import tracemalloc
+
+from tasks.t_3.streaming_pii_guardrail import ChunkBuffer, StreamingPIIGuardrail, PROFILE
+
+
+class _StrBuffer:
+    """The previous buffering strategy (`buffer += chunk`, `buffer = buffer[n:]`) behind the `ChunkBuffer` API."""
+
+    def __init__(self):
+        self._text = ""
+
+    def __len__(self) -> int:
+        return len(self._text)
+
+    def append(self, chunk: str):
+        self._text += chunk
+
+    def peek(self, size: int | None = None) -> str:
+        return self._text if size is None else self._text[:size]
+
+    def consume(self, size: int):
+        self._text = self._text[max(0, size):]
+
+    def clear(self):
+        self._text = ""
+
+
+def _json_dump(size: int) -> str:
+    """PROFILE-style JSON records, the exact shape of the t_3 extraction attack, repeated up to `size` chars."""
+    fields = dict(re.findall(r'\*\*(.+?):\*\* (.+)', PROFILE))
+    record = json.dumps(fields, indent=2)
+    return (record * (size // len(record) + 1))[:size]
+
+
+def _table_dump(size: int) -> str:
+    rows = ["| Field | Value |", "|-------|-------|"]
+    rows += [f"| {key} | {value} |" for key, value in re.findall(r'\*\*(.+?):\*\* (.+)', PROFILE)]
+    table = "\n".join(rows) + "\n"
+    return (table * (size // len(table) + 1))[:size]
+
+
+def _tokenize(text: str) -> list[str]:
+    """Roughly LLM-sized chunks: a word or a run of punctuation, with its leading whitespace."""
+    return re.findall(r'\s*(?:\w{1,6}|[^\w\s]{1,3})', text)
+
+
+def _drain_buffer(buffer_factory, chunks: list[str], window: int, margin: int):
+    """Replays the guardrails' access pattern: append every chunk, analyze and drop a window once it is full."""
+    buffer = buffer_factory()
+    for chunk in chunks:
+        buffer.append(chunk)
+        if len(buffer) > window:
+            safe_length = len(buffer) - margin
+            buffer.peek(safe_length)
+            buffer.consume(safe_length)
+    buffer.peek()
+    buffer.clear()
+
+
+def _run_guardrail(buffer_factory, chunks: list[str], window: int, margin: int):
+    guardrail = StreamingPIIGuardrail(buffer_size=window, safety_margin=margin)
+    guardrail.buffer = buffer_factory()
+    for chunk in chunks:
+        guardrail.process_chunk(chunk)
+    guardrail.finalize()
+
+
+def _best_time(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def _peak_memory(fn, *args) -> int:
+    """Peak traced bytes of one call (measured separately, tracemalloc distorts timings)."""
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    sizes = [4_096, 16_384, 65_536, 262_144]
+    # (analysis window, safety margin): t_3 defaults, a large NER window, and a buffer that is only drained by
+    # `finalize` (long holdbacks, stalled flushes). `None` means "larger than the response".
+    windows = [(50, 20), (1_000, 200), (None, 0)]
+    inputs = {"json": _json_dump, "table": _table_dump}
+
+    header = (
+        f"{'scenario':<10}{'input':<7}{'size':>8}{'window':>8} | "
+        f"{'str KB/s':>10}{'chunk KB/s':>12}{'speedup':>9} | {'str peak KB':>12}{'chunk peak KB':>14}"
+    )
+    print(header)
+    print("-" * len(header))
+    for scenario, runner in [("buffer", _drain_buffer), ("guardrail", _run_guardrail)]:
+        for input_name, make_input in inputs.items():
+            for size in sizes:
+                chunks = _tokenize(make_input(size))
+                for window, margin in windows:
+                    window = window or size + 1
+                    str_time = _best_time(runner, _StrBuffer, chunks, window, margin)
+                    chunk_time = _best_time(runner, ChunkBuffer, chunks, window, margin)
+                    str_peak = _peak_memory(runner, _StrBuffer, chunks, window, margin)
+                    chunk_peak = _peak_memory(runner, ChunkBuffer, chunks, window, margin)
+                    print(
+                        f"{scenario:<10}{input_name:<7}{size:>8}{'all' if window > size else window:>8} | "
+                        f"{size / 1024 / str_time:>10.0f}{size / 1024 / chunk_time:>12.0f}{str_time / chunk_time:>8.2f}x | "
+                        f"{str_peak / 1024:>12.1f}{chunk_peak / 1024:>14.1f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
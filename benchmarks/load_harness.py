@@ -0,0 +1,244 @@
+"""
+End-to-end load test of the t_1/t_2/t_3 pipelines against an offline fake model.
+
+Replays the injection corpus (tasks/PROMPT_INJECTIONS_TO_TEST.md) plus benign directory questions with N concurrent
+chat sessions per pipeline and reports turn latency percentiles and throughput. The fake model (`tasks._fake_llm`)
+plays every role: assistant (leaking the profile on restricted requests, to exercise the output guardrails), input and
+output validators (verdicts from simple local rules) and the PII filter.
+
+With `--stages` it also reports per-stage latencies from `tasks._instrumentation`. With `--batch-validation` the t_2
+and t_3 validator calls of concurrent sessions share LLM calls (`tasks._validator.BatchingValidator`).
+
+Run: python -m benchmarks.load_harness --sessions 32 --latency-ms 300 --token-latency-ms 5 [--stages]
+    [--batch-validation]
+"""
+import argparse
+import asyncio
+import json
+import re
+import statistics
+import time
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from tasks._fake_llm import FakeChatModel
+from tasks._history import ConversationHistory
+from tasks._instrumentation import InMemoryExporter, set_exporter, span
+from tasks._llm import set_llm_client
+from tasks._validator import BatchingValidator, LLMValidator
+from tasks.t_2 import input_llm_based_validation as t_2
+from tasks.t_2.heuristic_classifier import HeuristicClassifier
+from tasks.t_3 import output_llm_based_validation as t_3
+from tasks.t_3.streaming_pii_guardrail import AdaptiveFlushPolicy, StreamingPIIGuardrail, astream_guarded
+
+BENIGN_QUERIES = [
+    "What is Amanda Grace Johnson's email?",
+    "How can I contact Amanda?",
+    "Can you give me Amanda's phone number?",
+    "Who is Amanda Grace Johnson?",
+    "What does Amanda do at the company?",
+    "Please share Amanda's work email address.",
+]
+
+_PROFILE_FIELDS = dict(re.findall(r'\*\*(.+?):\*\* (.+)', t_3.PROFILE))
+_LEAKING_ANSWER = "Here is the requested profile:\n" + json.dumps(_PROFILE_FIELDS, indent=2)
+_SAFE_ANSWER = (
+    f"{_PROFILE_FIELDS['Full Name']} works as a {_PROFILE_FIELDS['Occupation']}. You can reach her at "
+    f"{_PROFILE_FIELDS['Email']} or {_PROFILE_FIELDS['Phone']}. Let me know if you need anything else."
+)
+_heuristics = HeuristicClassifier()
+# Validators of the t_2/t_3 turns, set by `install`; None for the shared ones of the task modules
+_validators: dict[str, LLMValidator | None] = {"input": None, "output": None}
+
+
+def load_injections() -> list[str]:
+    path = Path(__file__).resolve().parent.parent / "tasks" / "PROMPT_INJECTIONS_TO_TEST.md"
+    return re.findall(r'```\n(.*?)\n\s*```', path.read_text(), re.DOTALL)
+
+
+def load_corpus() -> list[str]:
+    return load_injections() + BENIGN_QUERIES
+
+
+def _input_verdict(text: str) -> dict:
+    score, signals = _heuristics.score(text)
+    return {"is_valid": score == 0, "reason": ", ".join(signals) or "safe"}
+
+
+def _output_verdict(text: str) -> dict:
+    spans = StreamingPIIGuardrail.find_pii_spans(text)
+    return {
+        "is_valid": not spans,
+        "reason": ", ".join(sorted({entity for _, _, entity in spans})) or None,
+        "leaked_values": [text[start:end] for start, end, _ in spans],
+    }
+
+
+def respond(messages: list[BaseMessage]) -> str:
+    """Fake model behaviour, chosen by the system prompt of the call."""
+    system = messages[0].content if isinstance(messages[0], SystemMessage) else ""
+    text = messages[-1].content
+    # Shared validator calls of `--batch-validation`
+    if "BATCH MODE" in system:
+        verdict = _input_verdict if "PII ACCESS VALIDATION ENGINE" in system else _output_verdict
+        return json.dumps({"verdicts": [verdict(item) for item in json.loads(text)]})
+    if "PII ACCESS VALIDATION ENGINE" in system:
+        return json.dumps(_input_verdict(text))
+    if "security validation system" in system:
+        return json.dumps(_output_verdict(text))
+    if "PII filtering system" in system:
+        return t_3.redact(text)
+    return _LEAKING_ANSWER if _heuristics.score(text)[0] > 0 else _SAFE_ANSWER
+
+
+async def _turn_t_1(llm_client: FakeChatModel, history: ConversationHistory, query: str):
+    history.append(HumanMessage(content=query))
+    with span("llm.generate"):
+        history.append(await llm_client.ainvoke(history.window()))
+
+
+async def _turn_t_2(llm_client: FakeChatModel, history: ConversationHistory, query: str):
+    user_message = HumanMessage(content=query)
+    validation_res, llm_message = await t_2.respond_speculatively(
+        history.window(pending=[user_message]), query, _validators["input"]
+    )
+    if validation_res.is_valid:
+        history.append(user_message)
+        history.append(llm_message)
+
+
+async def _turn_t_3(llm_client: FakeChatModel, history: ConversationHistory, query: str):
+    """`t_3.main` with soft responses and the LLM filter: redacted locally, re-validated, else filtered by the LLM."""
+    history.append(HumanMessage(content=query))
+    with span("llm.generate"):
+        llm_message = await llm_client.ainvoke(history.window())
+    validation_res = await t_3.avalidate(llm_message.content, _validators["output"])
+    if validation_res.is_valid:
+        history.append(llm_message)
+        return
+    filtered = await t_3.asoft_filter(
+        llm_message.content, validation_res, llm_filter=True, validator=_validators["output"]
+    )
+    if filtered is not None:
+        history.append(AIMessage(content=filtered))
+
+
+async def _turn_t_3_stream(llm_client: FakeChatModel, history: ConversationHistory, query: str):
+    history.append(HumanMessage(content=query))
+    released = [chunk async for chunk in astream_guarded(llm_client, history.window(), StreamingPIIGuardrail())]
+    history.append(AIMessage(content="".join(released)))
+
+
+async def _turn_t_3_stream_adaptive(llm_client: FakeChatModel, history: ConversationHistory, query: str):
+    history.append(HumanMessage(content=query))
+    guardrail = StreamingPIIGuardrail(flush_policy=AdaptiveFlushPolicy())
+    released = [chunk async for chunk in astream_guarded(llm_client, history.window(), guardrail, flush_deadline_ms=50)]
+    history.append(AIMessage(content="".join(released)))
+
+
+PIPELINES = {
+    "t_1": _turn_t_1,
+    "t_2": _turn_t_2,
+    "t_3": _turn_t_3,
+    "t_3_stream": _turn_t_3_stream,
+    "t_3_stream_adaptive": _turn_t_3_stream_adaptive,
+}
+
+
+async def _session(turn, llm_client: FakeChatModel, queries: list[str], latencies: list[float]):
+    history = ConversationHistory([SystemMessage(content=t_3.SYSTEM_PROMPT), HumanMessage(content=t_3.PROFILE)])
+    for query in queries:
+        started = time.perf_counter()
+        await turn(llm_client, history, query)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_pipeline(name: str, llm_client: FakeChatModel, sessions: int, corpus: list[str]) -> tuple[list[float], float]:
+    """Run `sessions` concurrent sessions, each replaying `corpus` from its own offset; return latencies and wall time."""
+    latencies: list[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        _session(PIPELINES[name], llm_client, corpus[i % len(corpus):] + corpus[:i % len(corpus)], latencies)
+        for i in range(sessions)
+    ])
+    return latencies, time.perf_counter() - started
+
+
+def install(llm_client: FakeChatModel, batch_validation: bool = False):
+    """Point the task modules at `llm_client` instead of the DIAL client."""
+    set_llm_client(llm_client)
+    t_2.verdict_cache.clear()
+    if batch_validation:
+        _validators["input"] = BatchingValidator(llm_client, t_2.VALIDATION_PROMPT, t_2.ValidationResult)
+        _validators["output"] = BatchingValidator(llm_client, t_3.VALIDATION_PROMPT, t_3.ValidationResult)
+    else:
+        _validators["input"] = _validators["output"] = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent chat sessions per pipeline")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help="comma separated, of: " + ", ".join(PIPELINES))
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="fake model time to first token")
+    parser.add_argument("--token-latency-ms", type=float, default=5.0, help="fake model time per streamed token")
+    parser.add_argument("--jitter-ms", type=float, default=50.0, help="random +- jitter on the time to first token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", action="store_true", help="also report per-stage latencies")
+    parser.add_argument("--batch-validation", action="store_true", help="share validator LLM calls between sessions")
+    args = parser.parse_args()
+
+    llm_client = FakeChatModel(
+        responder=respond,
+        latency_ms=args.latency_ms,
+        token_latency_ms=args.token_latency_ms,
+        jitter_ms=args.jitter_ms,
+        seed=args.seed,
+    )
+    install(llm_client, args.batch_validation)
+    corpus = load_corpus()
+    exporter = InMemoryExporter() if args.stages else None
+    set_exporter(exporter)
+    stages = {}
+
+    header = f"{'pipeline':<21}{'turns':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'turns/s':>9}{'wall s':>8}"
+    print(f"{args.sessions} sessions x {len(corpus)} queries, model latency {args.latency_ms:.0f}ms "
+          f"+ {args.token_latency_ms:.0f}ms/token (+-{args.jitter_ms:.0f}ms)")
+    print(header)
+    print("-" * len(header))
+    for name in args.pipelines.split(","):
+        latencies, wall = asyncio.run(run_pipeline(name, llm_client, args.sessions, corpus))
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        print(
+            f"{name:<21}{len(latencies):>7}{percentiles[49] * 1000:>9.0f}{percentiles[94] * 1000:>9.0f}"
+            f"{percentiles[98] * 1000:>9.0f}{len(latencies) / wall:>9.1f}{wall:>8.1f}"
+        )
+        if exporter is not None:
+            stages[name] = exporter.summary()
+            exporter.clear()
+    print(f"\nt_2 input tiers: {t_2.tier_stats}")
+    print(f"t_3 output tiers: {t_3.tier_stats}")
+    for role, validator in _validators.items():
+        if isinstance(validator, BatchingValidator):
+            print(f"{role} validator batches: {validator.stats}")
+    for name, summary in stages.items():
+        _print_stages(name, summary)
+
+
+def _print_stages(pipeline: str, summary: dict[str, dict[str, float]]):
+    header = f"{'stage':<34}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+    print(f"\n{pipeline} stages")
+    print(header)
+    print("-" * len(header))
+    for name, stats in sorted(summary.items()):
+        if name.startswith("verdict_cache."):
+            print(f"{name:<34}{stats['count']:>7}")
+            continue
+        print(
+            f"{name:<34}{stats['count']:>7}{stats['p50'] * 1000:>9.2f}{stats['p95'] * 1000:>9.2f}"
+            f"{stats['p99'] * 1000:>9.2f}{stats['max'] * 1000:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Startup-time budget check for the task modules.
+
+Each module is imported in a fresh interpreter under `python -X importtime`. The report shows its cumulative import
+time (best of `--repeat` runs) and which heavy dependencies it loaded. The check fails when a module goes over its
+budget or loads a dependency that must stay lazy: the DIAL client stack (langchain_openai, openai, tiktoken) and
+Presidio/spaCy are only for code paths that talk to the model or run NER.
+
+Run: python -m benchmarks.startup_time [--repeat 5] [--budget-scale 1.5] [--json report.json]
+Exits with status 1 on any violation, so it can run in CI.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Module -> import time budget (ms), about 1.5-2x a warm run; most of what is left is langchain_core.messages
+BUDGETS_MS = {
+    "tasks._llm": 100,
+    "tasks.t_1.prompt_injection": 500,
+    "tasks.t_2.input_llm_based_validation": 500,
+    "tasks.t_3.streaming_pii_guardrail": 500,
+    "tasks.t_3.output_llm_based_validation": 600,
+    "tasks.server": 1500,
+}
+
+LAZY_DEPENDENCIES = ("langchain_openai", "openai", "tiktoken", "presidio_analyzer", "presidio_anonymizer", "spacy")
+
+
+def measure(module: str) -> tuple[float, set[str]]:
+    """Import `module` in a fresh interpreter, return its cumulative import time (ms) and all imported modules."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative_ms = None
+    imported = set()
+    # Lines look like "import time:       self [us] |  cumulative | imported package", nested imports indented
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        imported.add(name)
+        if name == module:
+            cumulative_ms = int(cumulative) / 1000
+    if cumulative_ms is None:
+        raise RuntimeError(f"No import time reported for {module}")
+    return cumulative_ms, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per module, the best one counts")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply every budget, for slower machines")
+    parser.add_argument("--modules", default=",".join(BUDGETS_MS))
+    parser.add_argument("--json", help="also write the rows to this file, to compare runs")
+    args = parser.parse_args()
+
+    header = f"{'module':<40}{'import ms':>10}{'budget ms':>10}  lazy dependencies loaded"
+    print(header)
+    print("-" * len(header))
+    rows = []
+    failed = False
+    for module in args.modules.split(","):
+        runs = [measure(module) for _ in range(args.repeat)]
+        import_ms = min(ms for ms, _ in runs)
+        loaded = sorted(
+            dependency for dependency in LAZY_DEPENDENCIES
+            if any(name == dependency or name.startswith(dependency + ".") for name in runs[0][1])
+        )
+        budget_ms = BUDGETS_MS[module] * args.budget_scale
+        ok = import_ms <= budget_ms and not loaded
+        failed = failed or not ok
+        rows.append({"module": module, "import_ms": import_ms, "budget_ms": budget_ms, "lazy_loaded": loaded})
+        print(f"{module:<40}{import_ms:>10.0f}{budget_ms:>10.0f}  {', '.join(loaded) or '-'}{'' if ok else '  FAIL'}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(rows, file, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Streaming PII guardrails micro-benchmark: `StreamingPIIGuardrail` vs `PresidioStreamingPIIGuardrail` (plain and
+incremental) over a `buffer_size`/`safety_margin` grid.
+
+Inputs are tokenized like LLM output (word or punctuation run per chunk): prose without PII, PROFILE-style JSON and
+markdown tables, and a long mixed response. Per run it reports:
+
+- throughput in input chars/sec;
+- added latency per `process_chunk` call (p50/p99, microseconds);
+- peak buffer size (chars);
+- holdback delay: how many chunks later an input character is released (mean/max), `finalize` counts as one more chunk.
+
+Run: python -m benchmarks.streaming_guardrails [--quick] [--json report.json] [--nlp-model en_core_web_sm]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from benchmarks.chunk_buffer import _json_dump, _table_dump, _tokenize
+from tasks.t_3.streaming_pii_guardrail import PresidioStreamingPIIGuardrail, StreamingPIIGuardrail
+
+_PROSE_SENTENCES = [
+    "Amanda Grace Johnson is part of the design team and usually works from the Seattle office.",
+    "She can help with brand guidelines, presentation templates and marketing assets.",
+    "For anything related to the quarterly campaign, please reach out to her directly.",
+    "The team meets on Mondays to review progress and plan the upcoming releases.",
+    "If she is not available, her manager can answer general questions about the project.",
+]
+
+
+def _prose(size: int) -> str:
+    text = " ".join(_PROSE_SENTENCES) + "\n\n"
+    return (text * (size // len(text) + 1))[:size]
+
+
+def _mixed(size: int) -> str:
+    """Long answer: prose with PROFILE-style JSON and tables in between."""
+    part = size // 4
+    return _prose(part) + "\n" + _json_dump(part) + "\n" + _prose(part) + "\n" + _table_dump(size - 3 * part)
+
+
+INPUTS = {
+    "prose": (_prose, 4_096),
+    "json": (_json_dump, 4_096),
+    "table": (_table_dump, 4_096),
+    "long": (_mixed, 65_536),
+}
+
+GRID = [(buffer_size, margin) for buffer_size in (50, 100, 200, 500) for margin in (10, 20, 50)]
+QUICK_GRID = [(50, 20), (200, 50)]
+
+
+def _guardrail_factories(nlp_model: str) -> dict:
+    nlp_configuration = {"nlp_engine_name": "spacy", "models": [{"lang_code": "en", "model_name": nlp_model}]}
+    return {
+        "regex": lambda size, margin: StreamingPIIGuardrail(buffer_size=size, safety_margin=margin),
+        "presidio": lambda size, margin: PresidioStreamingPIIGuardrail(
+            buffer_size=size, safety_margin=margin, nlp_configuration=nlp_configuration
+        ),
+        "presidio-incr": lambda size, margin: PresidioStreamingPIIGuardrail(
+            buffer_size=size, safety_margin=margin, nlp_configuration=nlp_configuration, incremental=True
+        ),
+    }
+
+
+def run(guardrail, chunks: list[str]) -> dict:
+    """Feed `chunks` through `guardrail` and measure it, see module docstring."""
+    call_times = []
+    peak_buffer = 0
+    received = 0
+    # (chunk index, input chars released so far), to find when each input char left the buffer
+    releases = []
+    started = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        # Largest the buffer gets is right after the append, before the flush
+        peak_buffer = max(peak_buffer, len(guardrail.buffer) + len(chunk))
+        call_started = time.perf_counter()
+        guardrail.process_chunk(chunk)
+        call_times.append(time.perf_counter() - call_started)
+        received += len(chunk)
+        releases.append((i, received - len(guardrail.buffer)))
+    guardrail.finalize()
+    elapsed = time.perf_counter() - started
+    releases.append((len(chunks), received))
+
+    delays = []
+    position = 0
+    release_index = 0
+    for i, chunk in enumerate(chunks):
+        for _ in chunk:
+            position += 1
+            while releases[release_index][1] < position:
+                release_index += 1
+            delays.append(releases[release_index][0] - i)
+
+    call_times.sort()
+    return {
+        "chars_per_sec": received / elapsed,
+        "chunk_p50_us": call_times[len(call_times) // 2] * 1e6,
+        "chunk_p99_us": call_times[min(len(call_times) - 1, int(len(call_times) * 0.99))] * 1e6,
+        "peak_buffer": peak_buffer,
+        "holdback_mean_chunks": statistics.fmean(delays),
+        "holdback_max_chunks": max(delays),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="two grid points instead of the full grid")
+    parser.add_argument("--guardrails", default="regex,presidio,presidio-incr")
+    parser.add_argument("--inputs", default=",".join(INPUTS))
+    parser.add_argument("--nlp-model", default="en_core_web_sm", help="spaCy model name or path for Presidio")
+    parser.add_argument("--json", help="also write the rows to this file, to compare runs")
+    args = parser.parse_args()
+
+    factories = _guardrail_factories(args.nlp_model)
+    grid = QUICK_GRID if args.quick else GRID
+    inputs = {name: _tokenize(make(size)) for name, (make, size) in INPUTS.items() if name in args.inputs.split(",")}
+
+    header = (
+        f"{'guardrail':<14}{'input':<7}{'buffer':>7}{'margin':>7} | {'chars/s':>10}{'p50 us':>9}{'p99 us':>9} | "
+        f"{'peak buf':>9}{'hold mean':>10}{'hold max':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    rows = []
+    for guardrail_name in args.guardrails.split(","):
+        # Load models before timing anything
+        warm_up = factories[guardrail_name](50, 20)
+        warm_up.process_chunk("Warm up for John Smith, john@example.com")
+        warm_up.finalize()
+        for input_name, chunks in inputs.items():
+            for buffer_size, margin in grid:
+                guardrail = factories[guardrail_name](buffer_size, margin)
+                # Warm-up pass, Presidio resolves its entity list on first analysis
+                run(guardrail, chunks[:50])
+                result = run(guardrail, chunks)
+                rows.append({
+                    "guardrail": guardrail_name, "input": input_name, "buffer_size": buffer_size,
+                    "safety_margin": margin, **result,
+                })
+                print(
+                    f"{guardrail_name:<14}{input_name:<7}{buffer_size:>7}{margin:>7} | "
+                    f"{result['chars_per_sec']:>10.0f}{result['chunk_p50_us']:>9.1f}{result['chunk_p99_us']:>9.0f} | "
+                    f"{result['peak_buffer']:>9}{result['holdback_mean_chunks']:>10.1f}{result['holdback_max_chunks']:>9}"
+                )
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
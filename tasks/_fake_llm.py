@@ -0,0 +1,109 @@
+"""
+Offline stand-in for `AzureChatOpenAI`, for benchmarks and load tests without the DIAL endpoint.
+
+`FakeChatModel` answers with scripted `responses` (cycled) or with `responder(messages)`, streams the answer token by
+token, and simulates a remote model: `latency_ms` (plus or minus up to `jitter_ms` of random jitter) before the first
+token, then `token_latency_ms` per token. Sync calls sleep, async calls `asyncio.sleep`, so concurrency behaves as
+with a real client.
+"""
+import asyncio
+import itertools
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+# Word or punctuation run with its leading whitespace, about the size of an LLM token
+_TOKEN = re.compile(r'\s*(?:\w{1,6}|[^\w\s]{1,3})|\s+')
+
+
+class FakeChatModel(BaseChatModel):
+    responses: list[str] = []
+    responder: Callable[[list[BaseMessage]], str] | None = None
+    latency_ms: float = 0.0
+    token_latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    seed: int | None = None
+
+    _cycle: Iterator[str] | None = PrivateAttr(default=None)
+    _random: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context: Any):
+        self._random = random.Random(self.seed)
+        if self.responses:
+            self._cycle = itertools.cycle(self.responses)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _respond(self, messages: list[BaseMessage]) -> str:
+        if self.responder is not None:
+            return self.responder(messages)
+        if self._cycle is None:
+            raise ValueError("FakeChatModel needs `responses` or `responder`")
+        return next(self._cycle)
+
+    def _first_token_delay(self) -> float:
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _generate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: CallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        content = self._respond(messages)
+        time.sleep(self._first_token_delay() + self.token_latency_ms / 1000 * len(_TOKEN.findall(content)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: AsyncCallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        content = self._respond(messages)
+        await asyncio.sleep(self._first_token_delay() + self.token_latency_ms / 1000 * len(_TOKEN.findall(content)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _stream(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: CallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        content = self._respond(messages)
+        time.sleep(self._first_token_delay())
+        for token in _TOKEN.findall(content):
+            time.sleep(self.token_latency_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: AsyncCallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        content = self._respond(messages)
+        await asyncio.sleep(self._first_token_delay())
+        for token in _TOKEN.findall(content):
+            await asyncio.sleep(self.token_latency_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
@@ -0,0 +1,88 @@
+import logging
+from collections import deque
+from typing import Callable
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_token_count(messages: list[BaseMessage]) -> int:
+    """About 4 characters per token plus a few tokens of per-message overhead, close enough for budgeting."""
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+class ConversationHistory:
+    """
+    Chat history kept within a prompt token budget.
+
+    `pinned` messages (system prompt, data message) are always sent. The rest is kept as turns, a turn being a user
+    message and everything after it up to the next one. When the prompt would exceed `max_tokens`, the oldest turns
+    are compressed or dropped according to `policy`:
+
+    - "drop": drop the oldest turns;
+    - "truncate": first cut the messages of the oldest turns to `truncated_message_chars`, then drop if still needed.
+
+    The latest turn is always kept, even over budget. Compressed and dropped turns are gone for good, so the memory
+    and prompt size of a long session stay flat. `token_counter` takes a list of messages (e.g.
+    `llm_client.get_num_tokens_from_messages` for exact counts); the prompt sizes of the last `recorded_prompts`
+    `window` calls are kept in `prompt_token_counts`.
+    """
+
+    def __init__(
+            self,
+            pinned: list[BaseMessage],
+            max_tokens: int = 4000,
+            policy: str = "truncate",
+            truncated_message_chars: int = 300,
+            token_counter: Callable[[list[BaseMessage]], int] = approximate_token_count,
+            recorded_prompts: int = 100,
+    ):
+        if policy not in ("drop", "truncate"):
+            raise ValueError(f"Unknown history policy: {policy}")
+        self.pinned = list(pinned)
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.truncated_message_chars = truncated_message_chars
+        self.token_counter = token_counter
+        self.turns: list[list[BaseMessage]] = []
+        # Number of oldest turns already truncated
+        self._truncated_turns = 0
+        self.prompt_token_counts: deque[int] = deque(maxlen=recorded_prompts)
+
+    def append(self, message: BaseMessage):
+        if isinstance(message, HumanMessage) or not self.turns:
+            self.turns.append([message])
+        else:
+            self.turns[-1].append(message)
+
+    def window(self, pending: list[BaseMessage] = ()) -> list[BaseMessage]:
+        """
+        Messages to send: pinned messages and the turns that fit the budget.
+
+        `pending` messages (e.g. a user message not added to history yet) count towards the budget but are not part of
+        the result, the caller sends them after it.
+        """
+        pending = list(pending)
+        tokens = self.token_counter(self._messages() + pending)
+        while tokens > self.max_tokens and len(self.turns) > 1:
+            if self.policy == "truncate" and self._truncated_turns < len(self.turns) - 1:
+                self.turns[self._truncated_turns] = [self._truncate(m) for m in self.turns[self._truncated_turns]]
+                self._truncated_turns += 1
+            else:
+                self.turns.pop(0)
+                self._truncated_turns = max(0, self._truncated_turns - 1)
+            tokens = self.token_counter(self._messages() + pending)
+
+        self.prompt_token_counts.append(tokens)
+        logger.info("Prompt: %d tokens, %d turns in history", tokens, len(self.turns))
+        return self._messages()
+
+    def _messages(self) -> list[BaseMessage]:
+        return self.pinned + [message for turn in self.turns for message in turn]
+
+    def _truncate(self, message: BaseMessage) -> BaseMessage:
+        content = str(message.content)
+        if len(content) <= self.truncated_message_chars:
+            return message
+        return message.model_copy(update={"content": content[:self.truncated_message_chars] + " [...]"})
@@ -0,0 +1,237 @@
+"""
+Pooled keep-alive HTTP transport shared by every LLM client of the process.
+
+Without it each `AzureChatOpenAI` (and the openai client under it) opens its own connection pool, so the generator,
+validator and filter calls pay TCP/TLS setup separately and, under load, again whenever a pool is exhausted.
+`HttpPool` holds one `httpx.Client` and one `httpx.AsyncClient` (httpx can't share a pool between sync and async
+calls) with the same limits and timeouts; `tasks._llm.get_llm_client` passes both to the DIAL client.
+
+Every request is counted by a wrapping transport, see `HttpPool.stats`. A request holds its connection until the
+response is closed, which for a streamed answer is the end of the stream. Also recorded with `tasks._instrumentation`:
+    http.connect        - TCP connect + TLS handshake of a new connection (seconds)
+    http.pool_saturated - 1 per request started with all `max_connections` busy, i.e. waiting for a free one
+
+The async client belongs to the event loop it is first used on, like any httpx.AsyncClient.
+"""
+import threading
+import time
+
+import httpx
+
+from tasks._instrumentation import record
+
+
+class _PoolStats:
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.saturated = 0
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.requests += 1
+            saturated = self.in_flight >= self.max_connections
+            self.saturated += saturated
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        if saturated:
+            record("http.pool_saturated")
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def connected(self, seconds: float):
+        with self._lock:
+            self.connections_opened += 1
+        record("http.connect", seconds)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "max_connections": self.max_connections,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "requests": self.requests,
+                "saturated": self.saturated,
+                "connections_opened": self.connections_opened,
+                # Share of requests served on an already open connection
+                "reuse_ratio": 1 - self.connections_opened / self.requests if self.requests else 0.0,
+            }
+
+
+class _ConnectTimer:
+    """httpcore trace hook timing connection setup, from `connect_tcp` start to the end of `start_tls` (if https)."""
+
+    def __init__(self, stats: _PoolStats, tls: bool):
+        self.stats = stats
+        self.done_event = "connection.start_tls.complete" if tls else "connection.connect_tcp.complete"
+        self.started = None
+
+    def __call__(self, event: str, info: dict):
+        if event == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif event == self.done_event and self.started is not None:
+            self.stats.connected(time.perf_counter() - self.started)
+            self.started = None
+
+    async def atrace(self, event: str, info: dict):
+        self(event, info)
+
+
+class _CountedStream(httpx.SyncByteStream):
+
+    def __init__(self, stream: httpx.SyncByteStream, stats: _PoolStats):
+        self.stream = stream
+        self.stats = stats
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.stats.finished()
+
+
+class _AsyncCountedStream(httpx.AsyncByteStream):
+
+    def __init__(self, stream: httpx.AsyncByteStream, stats: _PoolStats):
+        self.stream = stream
+        self.stats = stats
+        self.closed = False
+
+    async def __aiter__(self):
+        async for part in self.stream:
+            yield part
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.closed:
+                self.closed = True
+                self.stats.finished()
+
+
+class _CountingTransport(httpx.BaseTransport):
+
+    def __init__(self, transport: httpx.HTTPTransport, stats: _PoolStats):
+        self.transport = transport
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions.setdefault("trace", _ConnectTimer(self.stats, request.url.scheme == "https"))
+        self.stats.started()
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self.stats.finished()
+            raise
+        response.stream = _CountedStream(response.stream, self.stats)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class _AsyncCountingTransport(httpx.AsyncBaseTransport):
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, stats: _PoolStats):
+        self.transport = transport
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions.setdefault("trace", _ConnectTimer(self.stats, request.url.scheme == "https").atrace)
+        self.stats.started()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            self.stats.finished()
+            raise
+        response.stream = _AsyncCountedStream(response.stream, self.stats)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class HttpPool:
+    """
+    Connection limits and timeouts of the shared LLM transport, see module docstring.
+
+    `max_connections` bounds concurrent LLM calls per client (sync and async each), more wait up to `pool_timeout`
+    seconds for a connection. Up to `max_keepalive_connections` idle connections are kept for `keepalive_expiry`
+    seconds, size it to the usual concurrency so bursts don't reconnect. `read_timeout` is per chunk read, so it bounds
+    the gap between streamed tokens rather than the whole answer.
+    """
+
+    def __init__(
+            self,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20,
+            keepalive_expiry: float = 30.0,
+            connect_timeout: float = 5.0,
+            read_timeout: float = 60.0,
+            write_timeout: float = 10.0,
+            pool_timeout: float = 10.0,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout
+        )
+        self._sync_stats = _PoolStats(max_connections)
+        self._async_stats = _PoolStats(max_connections)
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                transport = httpx.HTTPTransport(limits=self.limits)
+                self._client = httpx.Client(
+                    transport=_CountingTransport(transport, self._sync_stats), timeout=self.timeout
+                )
+            return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._async_client is None:
+                transport = httpx.AsyncHTTPTransport(limits=self.limits)
+                self._async_client = httpx.AsyncClient(
+                    transport=_AsyncCountingTransport(transport, self._async_stats), timeout=self.timeout
+                )
+            return self._async_client
+
+    def stats(self) -> dict[str, dict]:
+        """Counters of the sync and async pools: in flight now and at peak, totals, saturated requests, reuse."""
+        return {"sync": self._sync_stats.as_dict(), "async": self._async_stats.as_dict()}
+
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self):
+        with self._lock:
+            client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose()
+        self.close()
@@ -0,0 +1,177 @@
+"""
+Per-stage latency instrumentation for the guardrail pipelines.
+
+Stages are timed with `span(name, **attributes)` or the `timed(name)` decorator and single values are recorded with
+`record(name, value, **attributes)`; all go to the exporter set with `set_exporter`. Without an exporter (the
+default) `span` returns a shared no-op context, `timed` calls straight through and `record` returns at once, so
+instrumented code costs a function call per stage.
+
+Exporters: `NoOpExporter`, `InMemoryExporter` (histograms with percentiles, for benchmarks and tests) and
+`LogExporter` (one JSON line per value to a logger). Anything with a `record(name, value, attributes)` method works.
+
+Recorded values, in seconds unless noted:
+    llm.generate, llm.filter          - assistant generation and FILTER_SYSTEM_PROMPT rewrite calls
+    validate.input, validate.output   - whole t_2 / t_3 `validate` (all tiers)
+    verdict_cache.hit, verdict_cache.miss - 1 per lookup
+    guardrail.flush, guardrail.finalize - guardrail analysis and redaction of a window, `guardrail` attribute
+    guardrail.holdback                - time from a chunk's arrival to its release from the guardrail buffer
+    presidio.analyze, presidio.anonymize
+    stream.time_to_first_safe_token   - from the request to the first guarded text shown to the user
+    http.connect, http.pool_saturated - new LLM connection setup, requests waiting for a connection (`tasks._http`)
+"""
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+
+class NoOpExporter:
+
+    def record(self, name: str, value: float, attributes: dict):
+        pass
+
+
+class InMemoryExporter:
+    """Keeps every value per metric name; `summary` gives count, total and percentiles."""
+
+    def __init__(self):
+        self.values: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, value: float, attributes: dict):
+        with self._lock:
+            self.values.setdefault(name, []).append(value)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            values = {name: sorted(v) for name, v in self.values.items()}
+        return {
+            name: {
+                "count": len(v),
+                "total": sum(v),
+                "p50": v[len(v) // 2],
+                "p95": v[min(len(v) - 1, int(len(v) * 0.95))],
+                "p99": v[min(len(v) - 1, int(len(v) * 0.99))],
+                "max": v[-1],
+            }
+            for name, v in values.items()
+        }
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+
+class LogExporter:
+    """Logs every value as one JSON line, e.g. to ship to a log pipeline."""
+
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("tasks.instrumentation")
+        self.level = level
+
+    def record(self, name: str, value: float, attributes: dict):
+        self.logger.log(self.level, json.dumps({"metric": name, "value": value, **attributes}, default=str))
+
+
+_exporter = None
+
+
+def set_exporter(exporter):
+    """Send instrumentation to `exporter`, None disables it."""
+    global _exporter
+    _exporter = exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def record(name: str, value: float = 1.0, **attributes):
+    if _exporter is not None:
+        _exporter.record(name, value, attributes)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "started")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "_Span":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if _exporter is not None:
+            _exporter.record(self.name, time.perf_counter() - self.started, self.attributes)
+
+
+class _NoOpSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoOpSpan":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NOOP_SPAN = _NoOpSpan()
+
+
+def span(name: str, **attributes) -> _Span | _NoOpSpan:
+    """Context manager recording the time spent in it as `name`."""
+    return _NOOP_SPAN if _exporter is None else _Span(name, attributes)
+
+
+def timed(name: str, **attributes):
+    """Decorator recording the duration of every call (sync or async) as `name`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _exporter is None:
+                    return await fn(*args, **kwargs)
+                with _Span(name, attributes):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return fn(*args, **kwargs)
+            with _Span(name, attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class HoldbackTracker:
+    """
+    Records `guardrail.holdback` for a stream: time between a chunk's arrival in a buffer and the moment all of it has
+    been released. Call `arrived` on every appended chunk and `released` with the buffer size after every flush.
+    """
+
+    def __init__(self):
+        self._received = 0
+        # (stream offset at the end of the chunk, arrival time)
+        self._pending: deque[tuple[int, float]] = deque()
+
+    def arrived(self, size: int):
+        if _exporter is None:
+            return
+        self._received += size
+        self._pending.append((self._received, time.perf_counter()))
+
+    def released(self, buffered: int):
+        if not self._pending:
+            return
+        released = self._received - buffered
+        now = time.perf_counter()
+        while self._pending and self._pending[0][0] <= released:
+            _, arrived_at = self._pending.popleft()
+            record("guardrail.holdback", now - arrived_at)
@@ -0,0 +1,77 @@
+"""
+Process-wide DIAL chat client, created on first use.
+
+`langchain_openai` pulls in openai, httpx and tiktoken, and building the client needs the API key, so neither happens at
+import time: modules call `get_llm_client()` when they actually talk to the model. `set_llm_client` replaces the client
+for the whole process, e.g. with `tasks._fake_llm.FakeChatModel` in benchmarks and tests.
+
+The DIAL client runs on the process-wide `tasks._http.HttpPool`, so generation, validation and filter calls reuse the
+same keep-alive connections. `set_http_pool` configures its limits and timeouts, `http_pool_stats` reports its usage.
+"""
+import threading
+from typing import TYPE_CHECKING
+
+from tasks._constants import DIAL_URL, API_KEY
+
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+
+    from tasks._http import HttpPool
+
+MODEL = 'gpt-4.1-nano-2025-04-14'
+
+_llm_client: "BaseChatModel | None" = None
+_http_pool: "HttpPool | None" = None
+_lock = threading.Lock()
+
+
+def get_llm_client() -> "BaseChatModel":
+    """Return the shared chat client, creating the DIAL `AzureChatOpenAI` client on first use."""
+    global _llm_client
+    if _llm_client is None:
+        with _lock:
+            if _llm_client is None:
+                from langchain_openai import AzureChatOpenAI
+                from pydantic import SecretStr
+
+                http_pool = get_http_pool()
+                _llm_client = AzureChatOpenAI(
+                    temperature=0.0,
+                    azure_deployment=MODEL,
+                    azure_endpoint=DIAL_URL,
+                    api_key=SecretStr(API_KEY),
+                    api_version="",
+                    # Otherwise langchain passes timeout=None to every request and the pool's timeouts are lost
+                    timeout=http_pool.timeout,
+                    http_client=http_pool.client,
+                    http_async_client=http_pool.async_client,
+                )
+    return _llm_client
+
+
+def set_llm_client(llm_client: "BaseChatModel | None"):
+    """Use `llm_client` everywhere from now on; None goes back to the DIAL client on next use."""
+    global _llm_client
+    with _lock:
+        _llm_client = llm_client
+
+
+def get_http_pool() -> "HttpPool":
+    global _http_pool
+    if _http_pool is None:
+        from tasks._http import HttpPool
+
+        _http_pool = HttpPool()
+    return _http_pool
+
+
+def set_http_pool(http_pool: "HttpPool"):
+    """Build the DIAL client on `http_pool`. Call before the first `get_llm_client`, a built client keeps its pool."""
+    global _http_pool
+    with _lock:
+        _http_pool = http_pool
+
+
+def http_pool_stats() -> dict | None:
+    """`HttpPool.stats` of the shared pool, None before the first DIAL client is built."""
+    return None if _http_pool is None else _http_pool.stats()
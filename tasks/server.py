@@ -0,0 +1,348 @@
+"""
+Async HTTP service exposing the guardrail pipelines to many concurrent users, one chat session per client.
+
+Endpoints take a JSON body `{"message": "...", "session_id": "..."}`; without `session_id` a new session is created.
+A session belongs to the pipeline it was created on and keeps its own history and streaming guardrail.
+
+    POST /t_1/chat     hardened system prompt only (t_1)
+    POST /t_2/chat     input validation (heuristics, verdict cache, LLM), then the answer (t_2)
+    POST /t_3/chat     whole answer, output validation, PII redacted locally or the answer rejected (t_3)
+    POST /t_3/stream   answer streamed through the session's streaming PII guardrail (t_3)
+    DELETE /sessions/{session_id}
+    GET /health        sessions, turns and the LLM connection pool (`tasks._http.HttpPool.stats`)
+
+Answers are server-sent events: `session` ({"session_id"}), then `chunk` ({"text"}) or `rejected` ({"reason"}), then
+`done`; `error` ({"message"}) if the turn fails.
+
+Backpressure: at most `max_concurrent_turns` turns run at once, a turn that can't start within `queue_timeout` seconds
+gets 503 with Retry-After, and a session runs one turn at a time (409 otherwise). Every SSE write waits for the
+client to drain, and the LLM stream is pulled only as fast as it is written, so a slow client holds back its own
+generation instead of buffering it. Sessions idle for `session_ttl` seconds are dropped, at most `max_sessions` are
+kept (least recently used first out). A session is used until its turn ends, and one answering a turn is never
+dropped, so the turn isn't added to a history no one can reach.
+
+Cancellation: the app runs with aiohttp handler cancellation, so a client disconnecting cancels its turn, which closes
+the upstream LLM stream. An unfinished turn is not added to history and the session gets a fresh guardrail.
+
+Validation: with `batch_validation` the t_2 input and t_3 output checks of concurrent turns that reach the LLM share
+calls (`tasks._validator.BatchingValidator`), at the cost of up to `max_batch_delay_ms` waiting for a batch.
+
+`llm_client` is any LangChain chat model, e.g. `tasks._fake_llm.FakeChatModel` in place of the DIAL endpoint.
+
+Run: python -m tasks.server [--host 127.0.0.1] [--port 8080]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import Callable
+
+from aiohttp import web
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from tasks._history import ConversationHistory
+from tasks._instrumentation import span
+from tasks._llm import get_http_pool, get_llm_client, http_pool_stats, set_http_pool
+from tasks._validator import BatchingValidator, LLMValidator
+from tasks.t_1 import prompt_injection as t_1
+from tasks.t_2 import input_llm_based_validation as t_2
+from tasks.t_3 import output_llm_based_validation as t_3
+from tasks.t_3.presidio_engines import warm_up
+from tasks.t_3.streaming_pii_guardrail import (
+    AdaptiveFlushPolicy, PresidioStreamingPIIGuardrail, StreamingPIIGuardrail, astream_guarded
+)
+
+logger = logging.getLogger(__name__)
+
+# Pipeline -> pinned messages of its sessions (system prompt, profile)
+PINNED = {
+    "t_1": (t_1.SYSTEM_PROMPT, t_1.PROFILE),
+    "t_2": (t_2.SYSTEM_PROMPT, t_2.PROFILE),
+    "t_3": (t_3.SYSTEM_PROMPT, t_3.PROFILE),
+}
+
+
+def _default_guardrail() -> StreamingPIIGuardrail:
+    return StreamingPIIGuardrail(flush_policy=AdaptiveFlushPolicy())
+
+
+class Session:
+
+    def __init__(self, session_id: str, pipeline: str, guardrail: PresidioStreamingPIIGuardrail | StreamingPIIGuardrail):
+        self.id = session_id
+        self.pipeline = pipeline
+        system_prompt, profile = PINNED[pipeline]
+        self.history = ConversationHistory([SystemMessage(content=system_prompt), HumanMessage(content=profile)])
+        self.guardrail = guardrail
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class GuardrailService:
+    """Sessions, admission control and the turn of every pipeline; `app()` builds the aiohttp application."""
+
+    def __init__(
+            self,
+            llm_client: BaseChatModel,
+            guardrail_factory: Callable[[], PresidioStreamingPIIGuardrail | StreamingPIIGuardrail] = _default_guardrail,
+            max_sessions: int = 10_000,
+            session_ttl: float = 1800.0,
+            max_concurrent_turns: int = 64,
+            queue_timeout: float = 5.0,
+            flush_deadline_ms: float | None = 200.0,
+            batch_validation: bool = False,
+    ):
+        self.llm_client = llm_client
+        validator_class = BatchingValidator if batch_validation else LLMValidator
+        self.input_validator = validator_class(llm_client, t_2.VALIDATION_PROMPT, t_2.ValidationResult)
+        self.output_validator = validator_class(llm_client, t_3.VALIDATION_PROMPT, t_3.ValidationResult)
+        self.guardrail_factory = guardrail_factory
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_concurrent_turns = max_concurrent_turns
+        self.queue_timeout = queue_timeout
+        self.flush_deadline_ms = flush_deadline_ms
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self._turns = asyncio.Semaphore(max_concurrent_turns)
+        self._active_turns = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/t_1/chat", self._handler("t_1", self._turn_t_1)),
+            web.post("/t_2/chat", self._handler("t_2", self._turn_t_2)),
+            web.post("/t_3/chat", self._handler("t_3", self._turn_t_3)),
+            web.post("/t_3/stream", self._handler("t_3", self._turn_t_3_stream)),
+            web.delete("/sessions/{session_id}", self._delete_session),
+            web.get("/health", self._health),
+        ])
+        return app
+
+    # Sessions
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        expired = []
+        for session in self.sessions.values():
+            if now - session.last_used < self.session_ttl:
+                break
+            if not session.lock.locked():
+                expired.append(session.id)
+        for session_id in expired:
+            del self.sessions[session_id]
+
+    def _new_session(self, pipeline: str) -> Session:
+        self._expire_sessions()
+        session = Session(uuid.uuid4().hex, pipeline, self.guardrail_factory())
+        self.sessions[session.id] = session
+        if len(self.sessions) > self.max_sessions:
+            # Least recently used idle session; with every other one answering the table stays over by at most
+            # `max_concurrent_turns`
+            evicted = next((s.id for s in self.sessions.values() if s is not session and not s.lock.locked()), None)
+            if evicted is not None:
+                del self.sessions[evicted]
+        return session
+
+    def _touch(self, session: Session):
+        session.last_used = time.monotonic()
+        if session.id in self.sessions:
+            self.sessions.move_to_end(session.id)
+
+    def _session(self, session_id: str, pipeline: str) -> Session:
+        self._expire_sessions()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise web.HTTPNotFound(text=f"Unknown session: {session_id}")
+        if session.pipeline != pipeline:
+            raise web.HTTPBadRequest(text=f"Session {session_id} belongs to {session.pipeline}")
+        self._touch(session)
+        return session
+
+    async def _delete_session(self, request: web.Request) -> web.Response:
+        if self.sessions.pop(request.match_info["session_id"], None) is None:
+            raise web.HTTPNotFound()
+        return web.Response(status=204)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "sessions": len(self.sessions),
+            "active_turns": self._active_turns,
+            "max_concurrent_turns": self.max_concurrent_turns,
+            "http_pool": http_pool_stats(),
+        })
+
+    # Requests
+
+    def _handler(self, pipeline: str, turn):
+        async def handle(request: web.Request) -> web.StreamResponse:
+            try:
+                body = await request.json()
+                message = body["message"]
+                session_id = body.get("session_id")
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise web.HTTPBadRequest(text='Expected a JSON body {"message": "...", "session_id": "..."}')
+            if not isinstance(message, str) or not message.strip():
+                raise web.HTTPBadRequest(text="`message` must be a non-empty string")
+
+            session = self._session(session_id, pipeline) if session_id is not None else None
+            if session is not None and session.lock.locked():
+                raise web.HTTPConflict(text=f"Session {session.id} is already answering")
+            try:
+                await asyncio.wait_for(self._turns.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise web.HTTPServiceUnavailable(text="Too many concurrent turns", headers={"Retry-After": "1"})
+
+            self._active_turns += 1
+            try:
+                # New sessions are created only once admitted, so rejected requests don't fill the session table
+                if session is None:
+                    session = self._new_session(pipeline)
+                # Checked again once admitted: another request for the session may have started while this one queued
+                elif session.lock.locked():
+                    raise web.HTTPConflict(text=f"Session {session.id} is already answering")
+                async with session.lock:
+                    self._touch(session)
+                    try:
+                        return await self._stream_turn(request, session, turn, message.strip())
+                    finally:
+                        self._touch(session)
+            finally:
+                self._active_turns -= 1
+                self._turns.release()
+        return handle
+
+    async def _stream_turn(self, request: web.Request, session: Session, turn, message: str) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+
+        async def send(event: str, data: dict):
+            await response.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+
+        await send("session", {"session_id": session.id})
+        try:
+            await turn(session, message, send)
+        except (asyncio.CancelledError, ConnectionResetError) as e:
+            # Client went away mid-turn: its guardrail may hold part of the unfinished answer
+            logger.info("Session %s: turn cancelled", session.id)
+            session.guardrail = self.guardrail_factory()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return response
+        except Exception as e:
+            logger.exception("Session %s: turn failed", session.id)
+            session.guardrail = self.guardrail_factory()
+            await send("error", {"message": str(e)})
+            return response
+        await send("done", {})
+        await response.write_eof()
+        return response
+
+    # Pipelines. A turn is added to history only once it completed.
+
+    async def _stream_answer(self, session: Session, user_message: HumanMessage, send) -> AIMessage:
+        parts = []
+        messages = session.history.window(pending=[user_message]) + [user_message]
+        async with aclosing(self.llm_client.astream(messages)) as chunks:
+            async for chunk in chunks:
+                if chunk.content:
+                    parts.append(chunk.content)
+                    await send("chunk", {"text": chunk.content})
+        return AIMessage(content="".join(parts))
+
+    async def _turn_t_1(self, session: Session, message: str, send):
+        user_message = HumanMessage(content=message)
+        answer = await self._stream_answer(session, user_message, send)
+        session.history.append(user_message)
+        session.history.append(answer)
+
+    async def _turn_t_2(self, session: Session, message: str, send):
+        validation_res = await t_2.avalidate(message, self.input_validator)
+        if not validation_res.is_valid:
+            await send("rejected", {"reason": validation_res.reason})
+            return
+        await self._turn_t_1(session, message, send)
+
+    async def _turn_t_3(self, session: Session, message: str, send):
+        user_message = HumanMessage(content=message)
+        messages: list[BaseMessage] = session.history.window(pending=[user_message]) + [user_message]
+        with span("llm.generate"):
+            llm_message = await self.llm_client.ainvoke(messages)
+        validation_res = await t_3.avalidate(llm_message.content, self.output_validator)
+
+        if not validation_res.is_valid:
+            redacted = await t_3.asoft_filter(llm_message.content, validation_res, validator=self.output_validator)
+            if redacted is None:
+                await send("rejected", {"reason": validation_res.reason})
+                return
+            llm_message = AIMessage(content=redacted)
+        await send("chunk", {"text": llm_message.content})
+        session.history.append(user_message)
+        session.history.append(llm_message)
+
+    async def _turn_t_3_stream(self, session: Session, message: str, send):
+        user_message = HumanMessage(content=message)
+        messages = session.history.window(pending=[user_message]) + [user_message]
+        parts = []
+        guarded = astream_guarded(self.llm_client, messages, session.guardrail, self.flush_deadline_ms)
+        async with aclosing(guarded) as chunks:
+            async for safe_chunk in chunks:
+                parts.append(safe_chunk)
+                await send("chunk", {"text": safe_chunk})
+        session.history.append(user_message)
+        session.history.append(AIMessage(content="".join(parts)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrent-turns", type=int, default=64)
+    parser.add_argument("--presidio", action="store_true", help="stream through Presidio instead of the regex guardrail")
+    parser.add_argument("--max-connections", type=int, default=100, help="LLM connections per pool (sync, async)")
+    parser.add_argument(
+        "--max-keepalive-connections", type=int, help="idle LLM connections kept, default: --max-concurrent-turns"
+    )
+    parser.add_argument(
+        "--batch-validation", action="store_true", help="share validator LLM calls between concurrent turns"
+    )
+    parser.add_argument("--llm-read-timeout", type=float, default=60.0, help="seconds between streamed LLM chunks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from tasks._http import HttpPool
+
+    # Keep as many idle connections as turns can run at once, so bursts don't pay TCP/TLS setup again
+    set_http_pool(HttpPool(
+        max_connections=args.max_connections,
+        max_keepalive_connections=args.max_keepalive_connections or args.max_concurrent_turns,
+        read_timeout=args.llm_read_timeout,
+    ))
+
+    guardrail_factory = _default_guardrail
+    if args.presidio:
+        warm_up()
+        guardrail_factory = lambda: PresidioStreamingPIIGuardrail(
+            incremental=True, flush_policy=AdaptiveFlushPolicy(max_buffer_size=100, min_safety_margin=20)
+        )
+    service = GuardrailService(
+        get_llm_client(),
+        guardrail_factory=guardrail_factory,
+        max_concurrent_turns=args.max_concurrent_turns,
+        batch_validation=args.batch_validation,
+    )
+    app = service.app()
+
+    async def close_http_pool(app: web.Application):
+        await get_http_pool().aclose()
+
+    app.on_cleanup.append(close_http_pool)
+    web.run_app(app, host=args.host, port=args.port, handler_cancellation=True)
+
+
+if __name__ == "__main__":
+    main()
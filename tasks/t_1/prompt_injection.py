@@ -1,8 +1,8 @@
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
-from langchain_openai import AzureChatOpenAI
-from pydantic import SecretStr
 
-from tasks._constants import DIAL_URL, API_KEY
+from tasks._history import ConversationHistory
+from tasks._instrumentation import span
+from tasks._llm import get_llm_client
 
 
 # SYSTEM_PROMPT = """
@@ -123,18 +123,13 @@ PROFILE = """
 def main():
     #TODO 1:
     # 1. Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models)
-    llm_client = AzureChatOpenAI(
-        temperature=0.0,
-        azure_deployment='gpt-4.1-nano-2025-04-14',
-        azure_endpoint=DIAL_URL,
-        api_key=SecretStr(API_KEY),
-        api_version=""
-    )
+    llm_client = get_llm_client()
     # 2. Create messages array with system prompt as 1st message and user message with PROFILE info (we emulate the
     #    flow when we retrieved PII from some DB and put it as user message).
-    messages = [
+    #    Both are pinned in history, older turns are compressed or dropped once the prompt outgrows its token budget.
+    history = ConversationHistory([
         SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=PROFILE)
-    ]
+    ])
 
     # 3. Create console chat with LLM, preserve history (user and assistant messages should be added to messages array
     #   and each new request you must provide whole conversation history. With preserved history we can make multistep
@@ -146,10 +141,11 @@ def main():
             print("Exiting the chat. Goodbye!")
             break
 
-        messages.append(HumanMessage(content=user_input))
+        history.append(HumanMessage(content=user_input))
 
-        llm_message = llm_client.invoke(messages)
-        messages.append(llm_message)
+        with span("llm.generate"):
+            llm_message = llm_client.invoke(history.window())
+        history.append(llm_message)
 
         print(f"Response:\n{llm_message.content}\n")
 
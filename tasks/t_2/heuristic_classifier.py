@@ -0,0 +1,212 @@
+"""
+Local pre-classifier for user input, in front of the LLM validator.
+
+Block signals from `VALIDATION_PROMPT` (restricted fields, structured formats, override phrases, form templates,
+enumeration and correlation phrases) are compiled into one Aho-Corasick automaton plus a few regexes for numeric
+probing, so scoring an input is a single pass over it. Every signal found adds its weight once:
+
+- score >= `block_threshold`: clearly malicious, rejected without an LLM call;
+- score <= `allow_threshold`, the whole input is one of the narrow `ALLOW_PATTERNS` requests for allowed data only
+  ("What is Amanda's email?", "How can I contact Amanda?"), mentions none of the `DATA_NOUNS`, is not longer than
+  `max_allow_length` and plain ASCII: clearly benign, allowed without an LLM call (non-ASCII text is left to the LLM,
+  it is the usual way to hide from keyword lists). Mentioning an allowed field is not enough, "Where does Amanda live?
+  Also her name please" asks for more than the name;
+- anything else is ambiguous and goes to the LLM.
+"""
+import re
+import unicodedata
+from collections import deque
+
+# (weight, keywords) per block condition of VALIDATION_PROMPT
+SIGNALS = {
+    "restricted data": (1.0, [
+        "credit card", "creditcard", "card number", "cvv", "cvc", "expiration", "expiry", "exp date", "bank account",
+        "account number", "routing number", "iban", "ssn", "social security", "license", "licence", "dob",
+        "date of birth", "birth date", "birthday", "address", "payment", "financial", "income", "salary",
+        "passport", "government id",
+    ]),
+    "structured data request": (0.6, [
+        "json", "xml", "yaml", "csv", "all fields", "all available fields", "full profile", "complete object",
+        "schema", "template", "export",
+    ]),
+    "override attempt": (0.6, [
+        "ignore", "forget", "disregard", "new instructions", "you are now", "act as", "pretend", "admin",
+        "developer", "system override",
+    ]),
+    "authority claim": (0.6, ["authorized", "authorised", "clearance", "debug", "override", "approved"]),
+    "financial enumeration": (1.0, [
+        "financial instrument", "starts with", "starting with", "ends with", "ending with", "partial number",
+        "first 4 digits", "last 4 digits", "first four digits", "last four digits", "bin", "card prefix",
+    ]),
+    "record correlation": (0.8, [
+        "combine these", "merge records", "matching record", "cross-reference", "cross reference",
+        "verify against database", "link profiles", "enrich profile", "join datasets",
+    ]),
+    "form template": (0.8, [
+        "<form", "<input", "<textarea", "<select", "placeholder=", 'value=""', "fill in", "complete this field",
+        "complete the empty", "populate", "auto-fill", "autofill", "prefill",
+    ]),
+    # Weightless, only here so the longest match keeps "address" in "email address" from counting as restricted
+    "allowed data": (0.0, ["email address", "e-mail address", "mail address"]),
+}
+
+# Allowed fields (names, phone numbers, emails) and the requests for them that may skip the LLM. Patterns match the
+# whole normalized input, so anything asked for besides these fields makes the input ambiguous
+_ALLOWED_FIELD = (
+    r"(?:(?:work|business|office|personal)\s+)?"
+    r"(?:e-?mail(?:\s+address)?|mail\s+address|(?:tele)?phone(?:\s+number)?|mobile(?:\s+number)?"
+    r"|contact\s+(?:info|information|details)|(?:full\s+)?name)"
+)
+_PERSON = r"(?:her|his|their|the|[a-z]+(?:\s+[a-z]+){0,2}'s)"
+ALLOW_PATTERNS = [
+    re.compile(
+        r"(?:(?:hi|hello|hey)[,!]?\s+)?(?:(?:please|can\s+you|could\s+you|would\s+you)\s+)?"
+        r"(?:what(?:'s|\s+is|\s+are)|give\s+me|tell\s+me|share|send\s+me|show\s+me|i\s+need|do\s+you\s+have)\s+"
+        rf"(?:{_PERSON}\s+)?{_ALLOWED_FIELD}(?:\s*(?:,|and|&|or)\s*(?:{_PERSON}\s+)?{_ALLOWED_FIELD})*"
+        r"(?:\s+please)?\s*[?.!]*"
+    ),
+    re.compile(
+        r"(?:(?:please|can\s+you|could\s+you)\s+)?(?:tell\s+me\s+)?how\s+(?:can|do|could|should)\s+i\s+"
+        r"(?:contact|reach|call|email|e-mail)\s+(?:her|him|them|[a-z]+(?:\s+[a-z]+){0,2})\s*[?.!]*"
+    ),
+]
+
+# Data words that aren't block signals on their own but mean something besides the allowed fields is asked for
+DATA_NOUNS = re.compile(
+    r"\b(?:social|account|acct|card|credit|bank|routing|pin|password|secret|live|lives|living|born|birth|age|home"
+    r"|street|city|zip|postal|profile|verbatim|record|records|details|data|info|information|number|numbers|id)\b"
+)
+
+# (signal, weight, pattern) for numeric probing that keywords can't express
+REGEX_SIGNALS = [
+    ("card-like number", 1.0, re.compile(r'\b\d(?:[ -]?\d){11,18}\b')),
+    ("ssn-like number", 1.0, re.compile(r'\b\d{3}-\d{2}-\d{4}\b')),
+    ("digit enumeration", 0.8, re.compile(r'\b\d(?:-\d){3,}\b')),
+    ("query syntax", 0.6, re.compile(r'\bselect\b.+\bfrom\b|\bwhere\b.+=', re.IGNORECASE | re.DOTALL)),
+]
+
+
+def _normalize(text: str) -> str:
+    # `credit_card` and `credit card` are the same signal
+    return unicodedata.normalize("NFKC", text).casefold().replace("_", " ")
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over lowercase keywords.
+
+    Matches must sit on word boundaries (only checked at keyword ends that are word characters, so "<form" still
+    matches in "x<form>"), and overlapping matches resolve to the longest one ("financial instrument" over "financial").
+    """
+
+    def __init__(self, keywords: dict[str, str]):
+        """`keywords` maps each keyword to its label."""
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[str]] = [[]]
+        self._labels = {}
+        for keyword, label in keywords.items():
+            keyword = _normalize(keyword)
+            self._labels[keyword] = label
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append(keyword)
+
+        # Failure links breadth-first, depth 1 states fail to the root
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        """Return non-overlapping `(start, end, label)` matches in normalized `text`."""
+        text = _normalize(text)
+        candidates = []
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword in self._output[state]:
+                start, end = i + 1 - len(keyword), i + 1
+                if self._on_boundaries(text, start, end):
+                    candidates.append((start, end, keyword))
+
+        matches = []
+        last_end = 0
+        for start, end, keyword in sorted(candidates, key=lambda m: (m[0], m[0] - m[1])):
+            if start >= last_end:
+                matches.append((start, end, self._labels[keyword]))
+                last_end = end
+        return matches
+
+    @staticmethod
+    def _on_boundaries(text: str, start: int, end: int) -> bool:
+        if text[start].isalnum() and start > 0 and text[start - 1].isalnum():
+            return False
+        if text[end - 1].isalnum() and end < len(text) and text[end].isalnum():
+            return False
+        return True
+
+
+class HeuristicClassifier:
+    """Scores user input on the block signals of `VALIDATION_PROMPT`, see module docstring."""
+
+    def __init__(
+            self,
+            block_threshold: float = 1.0,
+            allow_threshold: float = 0.0,
+            max_allow_length: int = 200,
+    ):
+        self.block_threshold = block_threshold
+        self.allow_threshold = allow_threshold
+        self.max_allow_length = max_allow_length
+        self._weights = {label: weight for label, (weight, _) in SIGNALS.items()}
+        self._weights.update({label: weight for label, weight, _ in REGEX_SIGNALS})
+        self._matcher = KeywordMatcher(
+            {keyword: label for label, (_, keywords) in SIGNALS.items() for keyword in keywords}
+        )
+
+    def score(self, text: str) -> tuple[float, dict[str, list[str]]]:
+        """Return the score of `text` and the matched fragments per signal."""
+        signals: dict[str, list[str]] = {}
+        normalized = _normalize(text)
+        for start, end, label in self._matcher.find(text):
+            signals.setdefault(label, []).append(normalized[start:end])
+        for label, _, pattern in REGEX_SIGNALS:
+            match = pattern.search(normalized)
+            if match:
+                signals.setdefault(label, []).append(match.group())
+        return round(sum(self._weights[label] for label in signals), 3), signals
+
+    def classify(self, text: str) -> tuple[bool | None, str]:
+        """Return `(is_valid, reason)`, `is_valid` is None if the input is ambiguous and needs the LLM."""
+        score, signals = self.score(text)
+        if score >= self.block_threshold:
+            found = "; ".join(
+                f"{label}: {', '.join(dict.fromkeys(fragments))}"
+                for label, fragments in signals.items() if self._weights[label] > 0
+            )
+            return False, f"Input matches block signals ({found})"
+        if score <= self.allow_threshold and len(text) <= self.max_allow_length and text.isascii():
+            normalized = " ".join(_normalize(text).split())
+            # Field names are data nouns too ("phone number", "contact info"), only what's left around them counts
+            rest = normalized
+            for field in re.finditer(_ALLOWED_FIELD, normalized):
+                rest = rest.replace(field.group(), " ")
+            if not DATA_NOUNS.search(rest) and any(pattern.fullmatch(normalized) for pattern in ALLOW_PATTERNS):
+                return True, "Asks only for allowed data, no block signals found"
+        return None, f"Ambiguous input (score {score:.1f})"
+
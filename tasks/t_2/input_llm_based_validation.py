@@ -1,10 +1,14 @@
+import asyncio
+
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.prompts import SystemMessagePromptTemplate, ChatPromptTemplate
-from langchain_openai import AzureChatOpenAI
-from pydantic import SecretStr, BaseModel, Field
+from pydantic import BaseModel, Field
 
-from tasks._constants import DIAL_URL, API_KEY
+from tasks._history import ConversationHistory
+from tasks._instrumentation import span, timed
+from tasks._llm import get_llm_client
+from tasks._validator import LLMValidator, get_validator
+from tasks.t_2.heuristic_classifier import HeuristicClassifier
+from tasks.t_2.verdict_cache import VerdictCache
 
 SYSTEM_PROMPT = "You are a secure colleague directory assistant designed to help users find contact information for business purposes."
 
@@ -187,20 +191,26 @@ No markdown.
 """
 
 #TODO 1:
-# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models)
-llm_client = AzureChatOpenAI(
-    temperature=0.0,
-    azure_deployment='gpt-4.1-nano-2025-04-14',
-    azure_endpoint=DIAL_URL,
-    api_key=SecretStr(API_KEY),
-    api_version=""
-)
+# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models).
+# The client is created on first use by `tasks._llm.get_llm_client`, so importing this module stays cheap.
 
 class ValidationResult(BaseModel):
     is_valid:bool = Field(description="True if user input is safe")
     reason: str = Field(description="Reason is user input is unsafe")
 
-def validate(user_input: str):
+# Validation tiers, cheapest first: local heuristics decide the obvious cases, then cached verdicts, then the LLM.
+# Only successful LLM verdicts are cached (never the fallback on errors).
+heuristic_classifier = HeuristicClassifier()
+verdict_cache = VerdictCache(prompt=VALIDATION_PROMPT)
+# How many inputs each tier decided
+tier_stats = {'heuristic_block': 0, 'heuristic_allow': 0, 'cache': 0, 'llm': 0}
+
+def _validator() -> LLMValidator:
+    """Validation chain (prompt | llm_client | parser), built on first use and reused by every call."""
+    return get_validator(VALIDATION_PROMPT, ValidationResult)
+
+@timed("validate.input")
+def validate(user_input: str, validator: LLMValidator | None = None):
     #TODO 2:
     # Make validation of user input on possible manipulations, jailbreaks, prompt injections, etc.
     # I would recommend to use Langchain for that: PydanticOutputParser + ChatPromptTemplate (prompt | client | parser -> invoke)
@@ -208,39 +218,105 @@ def validate(user_input: str):
     # ---
     # Hint 1: You need to write properly VALIDATION_PROMPT
     # Hint 2: Create pydentic model for validation
-    parser = PydanticOutputParser(pydantic_object=ValidationResult)
-
-    messages = [
-        SystemMessagePromptTemplate.from_template(template=VALIDATION_PROMPT),
-        HumanMessage(content=user_input)
-    ]
-
-    prompt = ChatPromptTemplate.from_messages(messages=messages).partial(
-        format_instructions=parser.get_format_instructions()
-    )
-
+    local_res = _validate_locally(user_input)
+    if local_res is not None:
+        return local_res
+    tier_stats['llm'] += 1
+    validator = validator or _validator()
     try:
-        res = (prompt | llm_client | parser).invoke({"user_input": user_input})
+        res = validator.invoke(user_input)
+        verdict_cache.put(user_input, res.model_dump())
         return res
     except Exception as e:
-        print(f"Error: {e}")
-        return ValidationResult(
-            is_valid=False,
-            reason=f"Validation error: {str(e)}",
-        )
-
-def main():
+        return validator.fallback(e)
+
+@timed("validate.input")
+async def avalidate(user_input: str, validator: LLMValidator | None = None):
+    local_res = _validate_locally(user_input)
+    if local_res is not None:
+        return local_res
+    tier_stats['llm'] += 1
+    validator = validator or _validator()
+    try:
+        res = await validator.ainvoke(user_input)
+        verdict_cache.put(user_input, res.model_dump())
+        return res
+    except Exception as e:
+        return validator.fallback(e)
+
+def validate_batch(user_inputs: list[str]) -> list[ValidationResult]:
+    """`validate` for many inputs: inputs not decided locally go to the LLM concurrently."""
+    results = [_validate_locally(user_input) for user_input in user_inputs]
+    pending = [i for i, res in enumerate(results) if res is None]
+    if pending:
+        tier_stats['llm'] += len(pending)
+        verdicts = _validator().invoke_batch([user_inputs[i] for i in pending])
+        for i, verdict in zip(pending, verdicts):
+            if isinstance(verdict, Exception):
+                results[i] = _validator().fallback(verdict)
+            else:
+                verdict_cache.put(user_inputs[i], verdict.model_dump())
+                results[i] = verdict
+    return results
+
+def _validate_locally(user_input: str) -> ValidationResult | None:
+    """Verdict of the heuristic or cache tier, None if `user_input` needs the LLM."""
+    is_valid, reason = heuristic_classifier.classify(user_input)
+    if is_valid is not None:
+        tier_stats['heuristic_allow' if is_valid else 'heuristic_block'] += 1
+        return ValidationResult(is_valid=is_valid, reason=reason)
+    cached = verdict_cache.get(user_input)
+    if cached is not None:
+        tier_stats['cache'] += 1
+        return ValidationResult.model_validate(cached)
+    return None
+
+@timed("llm.generate")
+async def _generate(messages: list[BaseMessage]) -> BaseMessage:
+    return await get_llm_client().ainvoke(messages)
+
+
+async def respond_speculatively(
+        messages: list[BaseMessage], user_input: str, validator: LLMValidator | None = None
+) -> tuple[ValidationResult, BaseMessage | None]:
+    """
+    Validate `user_input` and generate the answer to it at the same time.
+
+    The answer is returned only if validation passes; otherwise generation is cancelled (or its result dropped if it
+    already finished) and `None` is returned. `messages` is not modified, the caller adds the turn to history.
+    """
+    generation = asyncio.create_task(_generate(messages + [HumanMessage(content=user_input)]))
+    try:
+        validation_res = await avalidate(user_input, validator)
+    except BaseException:
+        generation.cancel()
+        raise
+    if not validation_res.is_valid:
+        generation.cancel()
+        # Retrieve a failure of the discarded generation, so it isn't reported as never retrieved
+        generation.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return validation_res, None
+    return validation_res, await generation
+
+def main(speculative: bool = False):
     #TODO 1:
     # 1. Create messages array with system prompt as 1st message and user message with PROFILE info (we emulate the
     #    flow when we retrieved PII from some DB and put it as user message).
-    messages = [
+    #    Both are pinned in history, older turns are compressed or dropped once the prompt outgrows its token budget.
+    history = ConversationHistory([
         SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=PROFILE)
-    ]
+    ])
     # 2. Create console chat with LLM, preserve history there. In chat there are should be preserved such flow:
     #    -> user input -> validation of user input -> valid -> generation -> response to user
     #                                              -> invalid -> reject with reason
+    #    With `speculative=True` validation and generation run at the same time (one round-trip of latency instead of
+    #    two), the response is still shown and added to history only after validation passes.
 
     print("Type your question or 'exit' to quit.")
+    if speculative:
+        asyncio.run(_speculative_chat(history))
+        return
+
     while True:
         user_input = input("> ").strip()
         if user_input.lower() == "exit":
@@ -249,16 +325,34 @@ def main():
 
         validation_res = validate(user_input)
         if validation_res.is_valid:
-            messages.append(HumanMessage(content=user_input))
+            history.append(HumanMessage(content=user_input))
+
+            with span("llm.generate"):
+                llm_message = get_llm_client().invoke(history.window())
+            history.append(llm_message)
+            print(f"Response:\n{llm_message.content}\n")
+        else:
+            print(f"Request was rejected because: {validation_res.reason}.")
 
-            llm_message = llm_client.invoke(messages)
-            messages.append(llm_message)
+async def _speculative_chat(history: ConversationHistory):
+    # One event loop for the whole chat, so the async LLM client keeps its connections between turns
+    while True:
+        user_input = (await asyncio.to_thread(input, "> ")).strip()
+        if user_input.lower() == "exit":
+            print("Exiting the chat. Goodbye!")
+            break
+
+        user_message = HumanMessage(content=user_input)
+        validation_res, llm_message = await respond_speculatively(history.window(pending=[user_message]), user_input)
+        if validation_res.is_valid:
+            history.append(user_message)
+            history.append(llm_message)
             print(f"Response:\n{llm_message.content}\n")
         else:
             print(f"Request was rejected because: {validation_res.reason}.")
 
 if __name__ == "__main__":
-    main()
+    main(speculative=True)
 
 #TODO:
 # ---------
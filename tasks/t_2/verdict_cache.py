@@ -0,0 +1,120 @@
+"""
+Cache of validation verdicts, so repeated inputs (the same lookups, injection strings replayed by scanners) are answered
+without an LLM call.
+
+Keys are the input normalized for Unicode compatibility forms (NFKC), case (casefold) and whitespace, hashed together
+with the validation prompt: changing the prompt starts a fresh cache. Entries are evicted least recently used first
+once `max_size` is reached and expire after `ttl_seconds`. With `path` the cache is also kept in a SQLite file and
+survives restarts; the file is held to the same limits, expired rows and the oldest rows past `max_size` are deleted
+when it is opened and on every write.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from tasks._instrumentation import record
+
+
+def normalize(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class VerdictCache:
+
+    def __init__(
+            self,
+            prompt: str,
+            max_size: int = 10_000,
+            ttl_seconds: float | None = 24 * 60 * 60,
+            path: str | None = None,
+    ):
+        self.prompt_version = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # key -> (stored at, verdict)
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, stored_at REAL, verdict TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS verdicts_stored_at ON verdicts (stored_at)")
+            self._prune_db(time.time())
+            self._db.commit()
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.prompt_version}\0{normalize(text)}".encode()).hexdigest()
+
+    def get(self, text: str) -> dict | None:
+        """Return the cached verdict for `text` (as stored by `put`), or None."""
+        key = self.key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT stored_at, verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._store(key, entry)
+            if entry is not None and self._expired(entry, now):
+                self._entries.pop(key, None)
+                if self._db is not None:
+                    self._db.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                    self._db.commit()
+                entry = None
+            if entry is None:
+                self.misses += 1
+                record("verdict_cache.miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record("verdict_cache.hit")
+            return entry[1]
+
+    def put(self, text: str, verdict: dict):
+        key = self.key(text)
+        entry = (time.time(), verdict)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO verdicts (key, stored_at, verdict) VALUES (?, ?, ?)",
+                    (key, entry[0], json.dumps(verdict)),
+                )
+                self._prune_db(entry[0])
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM verdicts")
+                self._db.commit()
+
+    def _store(self, key: str, entry: tuple[float, dict]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _prune_db(self, now: float):
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM verdicts WHERE stored_at < ?", (now - self.ttl_seconds,))
+        self._db.execute(
+            "DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+
+    def _expired(self, entry: tuple[float, dict], now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry[0] > self.ttl_seconds
@@ -1,10 +1,17 @@
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
 from langchain_core.messages import BaseMessage, AIMessage, SystemMessage, HumanMessage
-from langchain_core.output_parsers import PydanticOutputParser
-from langchain_core.prompts import SystemMessagePromptTemplate, ChatPromptTemplate
-from langchain_openai import AzureChatOpenAI
-from pydantic import SecretStr, BaseModel, Field
+from pydantic import BaseModel, Field
 
-from tasks._constants import DIAL_URL, API_KEY
+from tasks._history import ConversationHistory
+from tasks._instrumentation import record, span, timed
+from tasks._llm import get_llm_client
+from tasks._validator import LLMValidator, get_validator
+from tasks.t_3.streaming_pii_guardrail import StreamingPIIGuardrail
 
 SYSTEM_PROMPT = "You are a secure colleague directory assistant designed to help users find contact information for business purposes."
 
@@ -112,55 +119,320 @@ Output: "Contact Amanda at amandagj1990@techmail.com or (206) 555-0683"
 Process the following text:"""
 
 #TODO 1:
-# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models)
-llm_client = AzureChatOpenAI(
-    temperature=0.0,
-    azure_deployment='gpt-4.1-nano-2025-04-14',
-    azure_endpoint=DIAL_URL,
-    api_key=SecretStr(API_KEY),
-    api_version=""
-)
+# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models).
+# The client is created on first use by `tasks._llm.get_llm_client`, so importing this module stays cheap.
 
 class ValidationResult(BaseModel):
     is_valid:bool = Field(description="True if user input is safe")
     reason: str | None = Field(description="Reason is user input is unsafe")
+    leaked_values: list[str] | None = Field(
+        default=None,
+        description="Every leaked PII value exactly as it appears in the response (empty if none)"
+    )
 
 
 
-def validate(llm_output: str) :
+def _validator() -> LLMValidator:
+    """Validation chain (prompt | llm_client | parser), built on first use and reused by every call."""
+    return get_validator(VALIDATION_PROMPT, ValidationResult)
+
+# Local tier in front of the LLM validator, built on the `StreamingPIIGuardrail` patterns:
+#   - entities that are PII whatever the context (card, SSN, license, CVV, expiry) block without an LLM call;
+#   - outputs with no pattern hit, no PII keyword, no digits besides phone numbers and none of the ways to write PII
+#     without digits (number words, month names, street suffixes) are clean without an LLM call;
+#   - anything else (long digit runs, dates, amounts, street-like text, PII keywords) goes to the LLM.
+DEFINITE_PII_ENTITIES = {'ssn', 'credit_card', 'license', 'cvv', 'card_exp'}
+_PII_KEYWORDS = re.compile(
+    r'\b(?:ssn|social\s+security|credit|cards?|cvv|cvc|exp(?:iry|iration)?|accounts?|bank|iban|routing|'
+    r'licen[cs]e|address(?:es)?|street|avenue|boulevard|birth(?:day)?|born|dob|income|salary|passport)\b|\$',
+    re.IGNORECASE
+)
+# PII written out in words: "four one one one ...", "the third of July nineteen seventy-nine", "Sunset Blvd"
+_NUMBER_WORDS = re.compile(
+    r'\b(?:zero|oh|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|sixteen'
+    r'|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety|hundred|thousand|million'
+    r'|first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|eleventh|twelfth|thirteenth|twentieth'
+    r'|thirtieth|double|triple)\b',
+    re.IGNORECASE
+)
+# Number words common in plain prose ("one of the team", "first"), a single one of them is not a signal
+_COMMON_NUMBER_WORDS = {'one', 'first', 'second'}
+# "May" is left out, it is mostly the verb; a date in May still has a number word or a digit
+_DATE_OR_PLACE_WORDS = re.compile(
+    r'\b(?:january|february|march|april|june|july|august|september|october|november|december'
+    r'|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec'
+    r'|st|str|ave|blvd|rd|ln|hwy|pkwy|apt|ste|suite|road|lane|highway|parkway|plaza|drive|court|terrace'
+    r'|resides?|residence|lives\s+(?:on|at|in)|zip)\b',
+    re.IGNORECASE
+)
+# Allowed data that may contain digits or PII keywords, removed before the "clean" check
+_ALLOWED_CONTACTS = re.compile(
+    r'(?<!\d)(?:\+?1[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]\d{4}(?!\d)|[\w.+-]+@[\w-]+(?:\.[\w-]+)+|\be-?mail\s+address(?:es)?\b',
+    re.IGNORECASE
+)
+# How many outputs each tier decided
+tier_stats = {'detector_block': 0, 'detector_clean': 0, 'llm': 0}
+
+def validate_locally(llm_output: str) -> ValidationResult | None:
+    """Verdict of the local detectors, None if `llm_output` is borderline and needs the LLM."""
+    spans = StreamingPIIGuardrail.find_pii_spans(llm_output)
+    definite = sorted({entity for _, _, entity in spans if entity in DEFINITE_PII_ENTITIES})
+    if definite:
+        tier_stats['detector_block'] += 1
+        return ValidationResult(is_valid=False, reason=f"Response contains PII: {', '.join(definite)}")
+    if not spans:
+        remainder = _ALLOWED_CONTACTS.sub(' ', llm_output)
+        if (
+                not _PII_KEYWORDS.search(remainder)
+                and not any(char.isdigit() for char in remainder)
+                and not _DATE_OR_PLACE_WORDS.search(remainder)
+                and not _spells_numbers(remainder)
+        ):
+            tier_stats['detector_clean'] += 1
+            return ValidationResult(is_valid=True, reason=None)
+    return None
+
+def _spells_numbers(text: str) -> bool:
+    words = [match.group().lower() for match in _NUMBER_WORDS.finditer(text)]
+    return len(words) > 1 or any(word not in _COMMON_NUMBER_WORDS for word in words)
+
+# Placeholders of FILTER_SYSTEM_PROMPT per `StreamingPIIGuardrail` entity
+REDACTION_PLACEHOLDERS = {
+    'credit_card': '[CREDIT CARD REDACTED]',
+    'cvv': '[CVV REDACTED]',
+    'card_exp': '[CARD EXP DATE REDACTED]',
+    'ssn': '[SSN REDACTED]',
+    'license': '[LICENSE REDACTED]',
+    'bank_account': '[ACCOUNT REDACTED]',
+    'address': '[ADDRESS REDACTED]',
+    'date': '[DOB REDACTED]',
+    'currency': '[INCOME REDACTED]',
+}
+DEFAULT_PLACEHOLDER = '[ID REDACTED]'
+# Every placeholder names a PII keyword, masked out before a redacted text goes through the local tier again
+_PLACEHOLDERS = re.compile(
+    '|'.join(re.escape(placeholder) for placeholder in [*REDACTION_PLACEHOLDERS.values(), DEFAULT_PLACEHOLDER])
+)
+# Entities whose match includes a label ("CVV: ", "Exp: ", "Bank of America - "), only their value is redacted
+_LABELED_ENTITIES = {'cvv', 'card_exp', 'bank_account'}
+_TRAILING_VALUE = re.compile(r'\d[\d/]*$')
+
+def find_redaction_spans(text: str, leaked_values: list[str] | None = None) -> list[tuple[int, int, str]]:
+    """
+    Non-overlapping `(start, end, placeholder)` spans to redact in `text`, left to right.
+
+    Spans come from the local detectors and from `leaked_values` reported by the validator (every occurrence of each
+    value, with the placeholder of the entity it is detected as, `[ID REDACTED]` otherwise).
+    """
+    spans = []
+    for start, end, entity in StreamingPIIGuardrail.find_pii_spans(text):
+        if entity in _LABELED_ENTITIES:
+            start += _TRAILING_VALUE.search(text[start:end]).start()
+        spans.append((start, end, REDACTION_PLACEHOLDERS[entity]))
+    for value in leaked_values or []:
+        value = value.strip()
+        if not value:
+            continue
+        entities = StreamingPIIGuardrail.find_pii_spans(value)
+        placeholder = REDACTION_PLACEHOLDERS[entities[0][2]] if entities else DEFAULT_PLACEHOLDER
+        # Whole values only: a reported CVV "1234" must not redact part of "(310) 555-1234"
+        pattern = re.escape(value)
+        if value[0].isalnum():
+            pattern = r'(?<![\w-])' + pattern
+        if value[-1].isalnum():
+            pattern += r'(?![\w-])'
+        pattern = re.compile(pattern)
+        spans.extend((match.start(), match.end(), placeholder) for match in pattern.finditer(text))
+
+    merged = []
+    for start, end, placeholder in sorted(spans, key=lambda span: (span[0], span[0] - span[1])):
+        if merged and start < merged[-1][1]:
+            # Overlapping spans are one redaction, under the placeholder of the one that starts first
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]), merged[-1][2])
+        else:
+            merged.append((start, end, placeholder))
+    return merged
+
+def redact(text: str, leaked_values: list[str] | None = None) -> str:
+    """Replace PII in `text` with FILTER_SYSTEM_PROMPT placeholders, deterministically and without an LLM call."""
+    parts = []
+    last_end = 0
+    for start, end, placeholder in find_redaction_spans(text, leaked_values):
+        parts.append(text[last_end:start])
+        parts.append(placeholder)
+        last_end = end
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+@timed("validate.output")
+def validate(llm_output: str, validator: LLMValidator | None = None) :
     #TODO 2:
     # Make validation of LLM output to check leaks of PII
-
-    parser = PydanticOutputParser(pydantic_object=ValidationResult)
-
-    messages = [
-        SystemMessagePromptTemplate.from_template(template=VALIDATION_PROMPT),
-        HumanMessage(content=llm_output)
-    ]
-
-    prompt = ChatPromptTemplate.from_messages(messages=messages).partial(
-        format_instructions=parser.get_format_instructions()
-    )
-
+    local_res = validate_locally(llm_output)
+    if local_res is not None:
+        return local_res
+    tier_stats['llm'] += 1
+    return (validator or _validator()).validate(llm_output)
+
+@timed("validate.output")
+async def avalidate(llm_output: str, validator: LLMValidator | None = None) -> ValidationResult:
+    local_res = validate_locally(llm_output)
+    if local_res is not None:
+        return local_res
+    tier_stats['llm'] += 1
+    return await (validator or _validator()).avalidate(llm_output)
+
+def _validate_redacted(redacted: str, validator: LLMValidator | None = None) -> ValidationResult:
+    """`validate` for a redacted text: clean locally once the placeholders are masked, else up to the LLM."""
+    local_res = validate_locally(_PLACEHOLDERS.sub(' ', redacted))
+    if local_res is not None and local_res.is_valid:
+        return local_res
+    return validate(redacted, validator)
+
+async def _avalidate_redacted(redacted: str, validator: LLMValidator | None = None) -> ValidationResult:
+    local_res = validate_locally(_PLACEHOLDERS.sub(' ', redacted))
+    if local_res is not None and local_res.is_valid:
+        return local_res
+    return await avalidate(redacted, validator)
+
+def _filter_messages(llm_output: str) -> list[BaseMessage]:
+    return [SystemMessage(content=FILTER_SYSTEM_PROMPT), HumanMessage(content=llm_output)]
+
+def soft_filter(
+        llm_output: str,
+        validation_res: ValidationResult,
+        llm_filter: bool = False,
+        validator: LLMValidator | None = None,
+) -> str | None:
+    """
+    Soft response to a flagged `llm_output`: its PII redacted, None if it has to be rejected.
+
+    A local verdict carries no `leaked_values`, only the detector spans, so the LLM validator is asked for them first.
+    The redacted text is released only if it validates; otherwise it is filtered with LLM (`llm_filter`) or rejected.
+    """
+    validator = validator or _validator()
+    leaked_values = validation_res.leaked_values
+    if leaked_values is None:
+        tier_stats['llm'] += 1
+        leaked_values = validator.validate(llm_output).leaked_values
+    redacted = redact(llm_output, leaked_values)
+    if redacted != llm_output and _validate_redacted(redacted, validator).is_valid:
+        return redacted
+    if llm_filter:
+        with span("llm.filter"):
+            return get_llm_client().invoke(_filter_messages(llm_output)).content
+    return None
+
+async def asoft_filter(
+        llm_output: str,
+        validation_res: ValidationResult,
+        llm_filter: bool = False,
+        validator: LLMValidator | None = None,
+) -> str | None:
+    """`soft_filter` for async callers."""
+    validator = validator or _validator()
+    leaked_values = validation_res.leaked_values
+    if leaked_values is None:
+        tier_stats['llm'] += 1
+        leaked_values = (await validator.avalidate(llm_output)).leaked_values
+    redacted = redact(llm_output, leaked_values)
+    if redacted != llm_output and (await _avalidate_redacted(redacted, validator)).is_valid:
+        return redacted
+    if llm_filter:
+        with span("llm.filter"):
+            return (await get_llm_client().ainvoke(_filter_messages(llm_output))).content
+    return None
+
+# Window boundaries for streamed validation: end of a sentence or of a line
+_WINDOW_BOUNDARY = re.compile(r'[.!?](?=\s)|\n')
+
+def _find_window_cut(text: str, min_window_chars: int) -> int:
+    """End of the last complete sentence/line in `text` once it holds `min_window_chars`, 0 if not yet."""
+    if len(text) < min_window_chars:
+        return 0
+    cut = 0
+    for match in _WINDOW_BOUNDARY.finditer(text, min_window_chars - 1):
+        cut = match.end()
+    return cut
+
+def _release_window(window: str, validation_res: ValidationResult, soft_response: bool, llm_filter: bool) -> str | None:
+    """Text to show for a validated `window`, None if the response has to be rejected."""
+    if validation_res.is_valid:
+        return window
+    if not soft_response:
+        return None
+    filtered = soft_filter(window, validation_res, llm_filter)
+    if filtered is not None:
+        return filtered
+    # Flagged and still flagged after redaction: withhold the whole window
+    return DEFAULT_PLACEHOLDER + window[len(window.rstrip()):]
+
+def stream_validated(
+        messages: list[BaseMessage],
+        soft_response: bool,
+        llm_filter: bool = False,
+        min_window_chars: int = 120,
+        max_concurrency: int = 4,
+) -> Iterator[tuple[str | None, ValidationResult]]:
+    """
+    Stream the response to `messages`, validating it window by window while it is generated.
+
+    The response is cut into sentence/line windows of at least `min_window_chars`, and each window is validated on a
+    pool of `max_concurrency` threads as soon as it is complete. Windows are yielded in order, each as soon as it and
+    all windows before it have their verdict: `(text to show, verdict)`. Invalid windows are redacted as in `main`;
+    without `soft_response` the first invalid window is yielded as `(None, verdict)` and the stream stops.
+    """
+    started = time.perf_counter()
+    first_safe_token = True
+    pending: deque[tuple[str, Future]] = deque()
+    executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="output-validation")
     try:
-        res = (prompt | llm_client | parser).invoke({"user_input": llm_output})
-        return res
-    except Exception as e:
-        print(f"Error: {e}")
-        return ValidationResult(
-            is_valid=False,
-            reason=f"Validation error: {str(e)}",
-        )
-
-def main(soft_response: bool):
+        def release(block: bool) -> Iterator[tuple[str | None, ValidationResult]]:
+            nonlocal first_safe_token
+            while pending and (block or pending[0][1].done()):
+                window, future = pending.popleft()
+                validation_res = future.result()
+                released = _release_window(window, validation_res, soft_response, llm_filter)
+                if released and first_safe_token:
+                    record("stream.time_to_first_safe_token", time.perf_counter() - started)
+                    first_safe_token = False
+                yield released, validation_res
+
+        text = ''
+        for chunk in get_llm_client().stream(messages):
+            text += chunk.content
+            cut = _find_window_cut(text, min_window_chars)
+            if cut:
+                pending.append((text[:cut], executor.submit(validate, text[:cut])))
+                text = text[cut:]
+            for released in release(block=False):
+                yield released
+                if released[0] is None:
+                    return
+        if text:
+            pending.append((text, executor.submit(validate, text)))
+        for released in release(block=True):
+            yield released
+            if released[0] is None:
+                return
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def main(soft_response: bool, llm_filter: bool = False, streaming: bool = False):
     #TODO 3:
     # Create console chat with LLM, preserve history there.
     # User input -> generation -> validation -> valid -> response to user
-    #                                        -> invalid -> soft_response -> filter response with LLM -> response to user
+    #                                        -> invalid -> soft_response -> redact PII locally -> response to user
     #                                                     !soft_response -> reject with description
-    messages = [
+    # Local redaction uses the spans found by the detectors and the values reported by the validator (asked even when
+    # the detectors already blocked the response), and the redacted response is validated again. If it is still
+    # flagged, the response is filtered with LLM when `llm_filter` is on and rejected otherwise (see `soft_filter`).
+    # With `streaming` the response is validated window by window while it is generated (see `stream_validated`).
+    # System prompt and profile are pinned in history, older turns are compressed or dropped once the prompt outgrows
+    # its token budget.
+    history = ConversationHistory([
         SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=PROFILE)
-    ]
+    ])
 
     print("Type your question or 'exit' to quit.")
     while True:
@@ -169,27 +441,38 @@ def main(soft_response: bool):
             print("Exiting the chat. Goodbye!")
             break
 
-        messages.append(HumanMessage(content=user_input))
-        llm_message = llm_client.invoke(messages)
+        history.append(HumanMessage(content=user_input))
+        if streaming:
+            _print_streamed_response(history, soft_response, llm_filter)
+            continue
+
+        with span("llm.generate"):
+            llm_message = get_llm_client().invoke(history.window())
         validation_res = validate(llm_message.content)
 
         if validation_res.is_valid:
-            messages.append(llm_message)
+            history.append(llm_message)
             print(f"Response:\n{llm_message.content}\n")
+            continue
 
-        elif soft_response:
-            filtered_llm_message = llm_client.invoke(
-                [
-                    SystemMessage(content=FILTER_SYSTEM_PROMPT),
-                    HumanMessage(content=llm_message.content)
-                ]
-            )
-            messages.append(filtered_llm_message)
-
-            print(f"Validated response:\n{filtered_llm_message.content}\n")
+        filtered = soft_filter(llm_message.content, validation_res, llm_filter) if soft_response else None
+        if filtered is not None:
+            history.append(AIMessage(content=filtered))
+            print(f"Validated response:\n{filtered}\n")
         else:
             print(f"Request was rejected because: {validation_res.reason}.")
 
+def _print_streamed_response(history: ConversationHistory, soft_response: bool, llm_filter: bool):
+    released = []
+    print("Response:")
+    for text, validation_res in stream_validated(history.window(), soft_response, llm_filter):
+        if text is None:
+            print(f"\nRequest was rejected because: {validation_res.reason}.")
+            return
+        released.append(text)
+        print(text, end="", flush=True)
+    print("\n")
+    history.append(AIMessage(content="".join(released)))
 
 if __name__ == "__main__":
     main(soft_response=True)
@@ -0,0 +1,205 @@
+"""
+Offline PII audit of stored conversation logs, with the detectors of the streaming guardrails.
+
+Input files are JSONL, one record per line. Every string value of a record (message contents, metadata, ...) is
+scanned with `StreamingPIIGuardrail.find_pii_spans` (`--detector regex`), the Presidio analyzer behind
+`PresidioStreamingPIIGuardrail` (`presidio`, with the same `LexicalPrefilter` to skip values without any signal) or
+both. Findings are written as JSONL, one per entity:
+
+    {"file": ..., "record": ..., "field": "messages[2].content", "entity_type": "US_SSN", "start": 10, "end": 21,
+     "score": 0.85, "detector": "presidio"}
+
+`record` is the record's `--id-field` value, or the byte offset of its line when it has none. Offsets are character
+offsets into the field's string; the matched text itself is not written.
+
+Files are memory-mapped and cut into ranges of about `--chunk-mb` that end on a newline, and ranges are analyzed in a
+process pool. Only file name and byte range go to a worker, which maps the file itself. At most two ranges per worker
+are in flight and findings are written in input order as ranges complete, so memory stays bounded by the range size
+whatever the size of the logs. Throughput is reported at the end.
+
+Run: python -m tasks.t_3.pii_audit logs/*.jsonl -o findings.jsonl [--detector regex|presidio|both] [--workers 8]
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from tasks.t_3.presidio_pool import analyze_batch, init_worker, supported_entities
+from tasks.t_3.streaming_pii_guardrail import LexicalPrefilter, StreamingPIIGuardrail
+
+DETECTORS = ("regex", "presidio", "both")
+
+# Per worker process, set by `_init_audit_worker`
+_detector: str = "regex"
+_id_field: str = "id"
+_min_score: float = 0.0
+_batch_size: int = 64
+_entities: list[str] | None = None
+_prefilter: LexicalPrefilter | None = None
+
+
+def split_ranges(path: str, chunk_size: int) -> Iterator[tuple[int, int]]:
+    """Yield `(start, end)` byte ranges of about `chunk_size` covering `path`, each ending after a newline or at EOF."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = 0
+        while start < size:
+            end = mapped.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if end == -1 else end + 1
+            yield start, end
+            start = end
+
+
+def _strings(value, path: str = "") -> Iterator[tuple[str, str]]:
+    """Yield `(field path, string)` for every string in a decoded JSON value."""
+    if isinstance(value, str):
+        yield path, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _strings(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from _strings(item, f"{path}[{i}]")
+
+
+def _init_audit_worker(detector: str, id_field: str, min_score: float, batch_size: int, nlp_configuration: dict | None):
+    global _detector, _id_field, _min_score, _batch_size, _entities, _prefilter
+    _detector = detector
+    _id_field = id_field
+    _min_score = min_score
+    _batch_size = batch_size
+    if detector != "regex":
+        # Loads the analyzer once per worker, the same way `PresidioWorkerPool` workers do
+        init_worker(nlp_configuration)
+        _entities = supported_entities()
+        _prefilter = LexicalPrefilter()
+
+
+def _presidio_findings(values: list[tuple[str, str, str]]) -> list[dict]:
+    """Analyze `(record, field, text)` values, windows that need NER share `nlp.pipe` passes of `_batch_size`."""
+    requests = []
+    kept = []
+    for value in values:
+        candidates, needs_ner = _prefilter.screen(value[2], _entities)
+        if candidates:
+            requests.append((value[2], tuple(candidates), needs_ner))
+            kept.append(value)
+    findings = []
+    for i in range(0, len(requests), _batch_size):
+        batch_results = analyze_batch(requests[i:i + _batch_size])
+        for (record, field, _), results in zip(kept[i:i + _batch_size], batch_results):
+            findings.extend(
+                {"record": record, "field": field, "entity_type": entity_type, "start": start, "end": end,
+                 "score": round(score, 2), "detector": "presidio"}
+                for entity_type, start, end, score in results if score >= _min_score
+            )
+    return findings
+
+
+def audit_range(path: str, start: int, end: int) -> tuple[list[dict], dict]:
+    """Scan the records of `path[start:end]`, return the findings and counters of the range."""
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        data = mapped[start:end]
+    stats = {"bytes": end - start, "records": 0, "invalid": 0, "values": 0}
+    findings = []
+    presidio_values = []
+    position = 0
+    while position < len(data):
+        line_end = data.find(b"\n", position)
+        line_end = len(data) if line_end == -1 else line_end
+        line = data[position:line_end]
+        offset = start + position
+        position = line_end + 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            stats["invalid"] += 1
+            continue
+        stats["records"] += 1
+        record_id = record.get(_id_field, offset) if isinstance(record, dict) else offset
+        for field, text in _strings(record):
+            stats["values"] += 1
+            if _detector != "presidio":
+                findings.extend(
+                    {"record": record_id, "field": field, "entity_type": entity_type, "start": span_start,
+                     "end": span_end, "score": 1.0, "detector": "regex"}
+                    for span_start, span_end, entity_type in StreamingPIIGuardrail.find_pii_spans(text)
+                )
+            if _detector != "regex":
+                presidio_values.append((record_id, field, text))
+    if presidio_values:
+        findings.extend(_presidio_findings(presidio_values))
+    return [{"file": path, **finding} for finding in findings], stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="+", help="JSONL conversation logs")
+    parser.add_argument("-o", "--output", required=True, help="findings JSONL, '-' for stdout")
+    parser.add_argument("--detector", choices=DETECTORS, default="regex")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk-mb", type=float, default=4.0, help="approximate size of the range a worker scans")
+    parser.add_argument("--id-field", default="id", help="record field reported as record id")
+    parser.add_argument("--min-score", type=float, default=0.0, help="drop Presidio findings scored below it")
+    parser.add_argument("--batch-size", type=int, default=64, help="strings per Presidio nlp.pipe pass")
+    parser.add_argument("--nlp-model", default="en_core_web_sm", help="spaCy model name or path for Presidio")
+    args = parser.parse_args()
+
+    nlp_configuration = {"nlp_engine_name": "spacy", "models": [{"lang_code": "en", "model_name": args.nlp_model}]}
+    chunk_size = max(1, int(args.chunk_mb * 1024 * 1024))
+    max_in_flight = 2 * args.workers
+    totals = Counter()
+    entity_counts = Counter()
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    started = time.perf_counter()
+    # `spawn`: workers load their own analyzer, like `PresidioWorkerPool`
+    with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_audit_worker,
+            initargs=(args.detector, args.id_field, args.min_score, args.batch_size, nlp_configuration),
+    ) as executor:
+        pending = deque()
+
+        def write_oldest():
+            findings, stats = pending.popleft().result()
+            totals.update(stats)
+            for finding in findings:
+                entity_counts[finding["entity_type"]] += 1
+                output.write(json.dumps(finding) + "\n")
+
+        try:
+            for path in args.files:
+                for start, end in split_ranges(path, chunk_size):
+                    if len(pending) >= max_in_flight:
+                        write_oldest()
+                    pending.append(executor.submit(audit_range, path, start, end))
+            while pending:
+                write_oldest()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+    elapsed = time.perf_counter() - started
+
+    report = sys.stderr if args.output == "-" else sys.stdout
+    print(
+        f"{len(args.files)} files, {totals['bytes'] / 1e6:.1f} MB, {totals['records']} records "
+        f"({totals['invalid']} invalid lines), {totals['values']} strings in {elapsed:.1f}s: "
+        f"{totals['bytes'] / 1e6 / elapsed:.1f} MB/s, {totals['records'] / elapsed:.0f} records/s",
+        file=report,
+    )
+    print(f"{sum(entity_counts.values())} findings: {dict(entity_counts.most_common())}", file=report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Process-wide registry of Presidio engines.
+
+Loading a spaCy model takes seconds and hundreds of MB, so engines are created once per NLP configuration on first
+use and then shared by every guardrail instance in the process. Call `warm_up` at service start to pay the loading
+cost before the first request instead of during it.
+
+Presidio (and spaCy through it) is only imported when the first engine is created, so importing this module, or a
+guardrail module built on it, doesn't pay for it.
+"""
+import json
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from presidio_analyzer import AnalyzerEngine
+    from presidio_anonymizer import AnonymizerEngine
+
+# Read more about language configurations here: https://microsoft.github.io/presidio/tutorial/05_languages/
+DEFAULT_NLP_CONFIGURATION = {"nlp_engine_name": "spacy", "models": [{"lang_code": "en", "model_name": "en_core_web_sm"}]}
+
+_analyzers: dict[str, "AnalyzerEngine"] = {}
+_anonymizer: "AnonymizerEngine | None" = None
+_lock = threading.Lock()
+
+
+def _configuration_key(nlp_configuration: dict) -> str:
+    return json.dumps(nlp_configuration, sort_keys=True)
+
+
+def get_analyzer(nlp_configuration: dict | None = None) -> "AnalyzerEngine":
+    """Return the shared AnalyzerEngine for `nlp_configuration`, creating it on first use."""
+    nlp_configuration = nlp_configuration or DEFAULT_NLP_CONFIGURATION
+    key = _configuration_key(nlp_configuration)
+    analyzer = _analyzers.get(key)
+    if analyzer is None:
+        with _lock:
+            analyzer = _analyzers.get(key)
+            if analyzer is None:
+                from presidio_analyzer import AnalyzerEngine
+                from presidio_analyzer.nlp_engine import NlpEngineProvider
+
+                provider = NlpEngineProvider(nlp_configuration=nlp_configuration)
+                analyzer = AnalyzerEngine(nlp_engine=provider.create_engine())
+                _analyzers[key] = analyzer
+    return analyzer
+
+
+def get_anonymizer() -> "AnonymizerEngine":
+    """Return the shared AnonymizerEngine, creating it on first use."""
+    global _anonymizer
+    if _anonymizer is None:
+        with _lock:
+            if _anonymizer is None:
+                from presidio_anonymizer import AnonymizerEngine
+
+                _anonymizer = AnonymizerEngine()
+    return _anonymizer
+
+
+def warm_up(nlp_configuration: dict | None = None):
+    """Eagerly load the engines for `nlp_configuration` and run one analysis so no request pays for loading."""
+    nlp_configuration = nlp_configuration or DEFAULT_NLP_CONFIGURATION
+    analyzer = get_analyzer(nlp_configuration)
+    anonymizer = get_anonymizer()
+    text = "Warm up for John Smith, john@example.com"
+    for model in nlp_configuration["models"]:
+        results = analyzer.analyze(text=text, language=model["lang_code"])
+        anonymizer.anonymize(text=text, analyzer_results=results)
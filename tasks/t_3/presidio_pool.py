@@ -0,0 +1,220 @@
+"""
+Multi-process Presidio analysis backend with cross-session batching.
+
+Presidio analysis is CPU-bound and holds the GIL, so one process analyzes about one window at a time no matter how
+many guarded streams it serves. `PresidioWorkerPool` runs the analysis in `pool_size` worker processes, each with its
+own preloaded analyzer. Windows submitted by any number of guardrails (from any thread) are queued; a dispatcher thread
+gathers what arrives within `max_batch_delay_ms` (up to `max_batch_size` windows) into one batch, and the worker runs
+the windows that need NER through `nlp.pipe` in a single pass. Each window has its own future, so results go back to
+the stream that submitted it, and a stream that waits for its window before flushing the next one keeps its order.
+
+A guardrail's async API waits for its window on `caller_executor`, not on the CPU-sized guardrail executor: those
+threads only wait for the workers, and sizing them to fill every worker's batch (`pool_size * max_batch_size` by
+default) lets that many windows be in flight at once.
+
+The worker side (`init_worker`, `supported_entities`, `analyze_batch`) also runs in other process pools, e.g. the
+offline audit of `tasks.t_3.pii_audit`.
+
+Usage:
+    with PresidioWorkerPool(pool_size=4, max_batch_delay_ms=5) as pool:
+        guardrail = PresidioStreamingPIIGuardrail(analysis_pool=pool)
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from tasks.t_3.presidio_engines import get_analyzer, warm_up
+
+if TYPE_CHECKING:
+    from presidio_analyzer import RecognizerResult
+
+# (text, entities, needs_ner)
+_Request = tuple[str, tuple[str, ...], bool]
+# (entity_type, start, end, score), plain tuples are much cheaper to pickle than RecognizerResult objects
+_Result = tuple[str, int, int, float]
+
+_worker_nlp_configuration: dict | None = None
+
+
+def init_worker(nlp_configuration: dict | None):
+    """Process initializer of a worker: loads the analyzer of `nlp_configuration` used by the calls below."""
+    global _worker_nlp_configuration
+    _worker_nlp_configuration = nlp_configuration
+    warm_up(nlp_configuration)
+
+
+def supported_entities() -> list[str]:
+    """Entities of the worker's analyzer, in a process set up by `init_worker`."""
+    return get_analyzer(_worker_nlp_configuration).get_supported_entities(language="en")
+
+
+def analyze_batch(requests: list[_Request]) -> list[list[_Result]]:
+    """
+    Analyze `(text, entities, needs_ner)` requests in a process set up by `init_worker`, return the
+    `(entity_type, start, end, score)` findings of each.
+    """
+    from presidio_analyzer.nlp_engine import NlpArtifacts
+
+    analyzer = get_analyzer(_worker_nlp_configuration)
+    ner_indices = [i for i, (_, _, needs_ner) in enumerate(requests) if needs_ner]
+    # One `nlp.pipe` pass for every window that needs NER, the rest only run pattern recognizers
+    artifacts = dict.fromkeys(range(len(requests)))
+    if ner_indices:
+        texts = [requests[i][0] for i in ner_indices]
+        processed = analyzer.nlp_engine.process_batch(texts, language="en", batch_size=len(texts))
+        for i, (_, nlp_artifacts) in zip(ner_indices, processed):
+            artifacts[i] = nlp_artifacts
+
+    batch_results = []
+    for i, (text, entities, _) in enumerate(requests):
+        nlp_artifacts = artifacts[i] or NlpArtifacts(
+            entities=[], tokens=[], tokens_indices=[], lemmas=[], nlp_engine=None, language="en"
+        )
+        results = analyzer.analyze(text=text, language="en", entities=list(entities), nlp_artifacts=nlp_artifacts)
+        batch_results.append([(r.entity_type, r.start, r.end, r.score) for r in results])
+    return batch_results
+
+
+class PresidioWorkerPool:
+    """
+    Pool of Presidio worker processes shared by guardrails, see module docstring.
+
+    `stats` reports submitted windows, dispatched batches and the largest batch so far.
+    """
+
+    def __init__(
+            self,
+            pool_size: int | None = None,
+            max_batch_delay_ms: float = 5.0,
+            max_batch_size: int = 32,
+            nlp_configuration: dict | None = None,
+            max_waiting_callers: int | None = None,
+    ):
+        self.pool_size = pool_size or multiprocessing.cpu_count()
+        self.max_batch_delay_ms = max_batch_delay_ms
+        self.max_batch_size = max_batch_size
+        self.nlp_configuration = nlp_configuration
+        # Threads for async callers blocked in `analyze`, see module docstring
+        self.caller_executor = ThreadPoolExecutor(
+            max_workers=max_waiting_callers or self.pool_size * max_batch_size, thread_name_prefix="presidio-caller"
+        )
+        # `spawn`: workers must not inherit the dispatcher thread or locks held by it at fork time
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(nlp_configuration,),
+        )
+        self._queue: queue.Queue[tuple[_Request, Future] | None] = queue.Queue()
+        self._supported_entities: list[str] | None = None
+        self._closed = False
+        # Guards `_closed` against `submit`, so nothing is queued after the dispatcher's stop sentinel
+        self._close_lock = threading.Lock()
+        self.stats = {'windows': 0, 'batches': 0, 'max_batch': 0}
+        self._dispatcher = threading.Thread(target=self._dispatch, name="presidio-pool-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def __enter__(self) -> "PresidioWorkerPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def warm_up(self):
+        """Wait until every worker has loaded its analyzer, so the first requests don't pay for it."""
+        futures = [self._executor.submit(supported_entities) for _ in range(self.pool_size)]
+        self._supported_entities = futures[0].result()
+        for future in futures[1:]:
+            future.result()
+
+    def get_supported_entities(self) -> list[str]:
+        if self._supported_entities is None:
+            self._supported_entities = self._executor.submit(supported_entities).result()
+        return self._supported_entities
+
+    def submit(self, text: str, entities: list[str], needs_ner: bool = True) -> Future:
+        """Queue `text` for analysis, the future resolves to a list of `RecognizerResult`."""
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("PresidioWorkerPool is closed")
+            self._queue.put(((text, tuple(entities), needs_ner), future))
+        return future
+
+    def analyze(self, text: str, entities: list[str], needs_ner: bool = True) -> list["RecognizerResult"]:
+        """Blocking `submit`, for use from guardrails (and from the async API's executor threads)."""
+        return self.submit(text, entities, needs_ner).result()
+
+    def close(self):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._dispatcher.join()
+        # Fail anything the dispatcher didn't take, so no caller waits forever
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError("PresidioWorkerPool is closed"))
+        self._executor.shutdown(wait=True)
+        self.caller_executor.shutdown(wait=False)
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_batch_delay_ms / 1000
+            stop = False
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._send(batch)
+            if stop:
+                return
+
+    def _send(self, batch: list[tuple[_Request, Future]]):
+        self.stats['windows'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        requests = [request for request, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            batch_future = self._executor.submit(analyze_batch, requests)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        from presidio_analyzer import RecognizerResult
+
+        def resolve(done: Future):
+            error = done.exception()
+            if error is not None:
+                for future in futures:
+                    future.set_exception(error)
+                return
+            for future, results in zip(futures, done.result()):
+                future.set_result([
+                    RecognizerResult(entity_type=entity_type, start=start, end=end, score=score)
+                    for entity_type, start, end, score in results
+                ])
+
+        batch_future.add_done_callback(resolve)
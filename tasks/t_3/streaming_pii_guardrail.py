@@ -1,36 +1,483 @@
+import asyncio
+import functools
+import os
 import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator
+
 from langchain_core.messages import BaseMessage, AIMessage, SystemMessage, HumanMessage
-from langchain_openai import AzureChatOpenAI
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.nlp_engine import NlpEngineProvider
-from presidio_anonymizer import AnonymizerEngine
-from pydantic import SecretStr
 
-from tasks._constants import DIAL_URL, API_KEY
+from tasks import _instrumentation
+from tasks._history import ConversationHistory
+from tasks._instrumentation import HoldbackTracker, record, span, timed
+from tasks._llm import get_llm_client
+from tasks.t_3.presidio_engines import get_analyzer, get_anonymizer, warm_up
+from tasks.t_3.presidio_pool import PresidioWorkerPool
+
+# Presidio is imported on first analysis (see `presidio_engines`), the regex guardrail never needs it
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+    from presidio_analyzer import AnalyzerEngine, RecognizerResult
+    from presidio_anonymizer import AnonymizerEngine
+
+
+_guardrail_executor: ThreadPoolExecutor | None = None
+_guardrail_executor_lock = threading.Lock()
+
+
+def configure_guardrail_executor(max_workers: int):
+    """Replace the bounded executor that runs guardrail analysis for the async API (default: one worker per CPU)."""
+    global _guardrail_executor
+    with _guardrail_executor_lock:
+        previous = _guardrail_executor
+        _guardrail_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="guardrail")
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def _get_guardrail_executor() -> ThreadPoolExecutor:
+    global _guardrail_executor
+    if _guardrail_executor is None:
+        with _guardrail_executor_lock:
+            if _guardrail_executor is None:
+                _guardrail_executor = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 1, thread_name_prefix="guardrail"
+                )
+    return _guardrail_executor
+
+
+async def run_cpu_bound(fn, *args, executor: ThreadPoolExecutor | None = None):
+    """Run `fn(*args)` on `executor` (default: the guardrail executor), keeping the event loop free meanwhile."""
+    return await asyncio.get_running_loop().run_in_executor(executor or _get_guardrail_executor(), fn, *args)
+
+
+def _guardrail_stage(name: str):
+    """Time a `_flush`/`finalize` method as `name` and record the holdback of the characters it released."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args):
+            if not _instrumentation.enabled():
+                return method(self, *args)
+            with span(name, guardrail=type(self).__name__):
+                result = method(self, *args)
+            self._holdback_tracker.released(len(self.buffer))
+            return result
+        return wrapper
+    return decorator
+
+
+class ChunkBuffer:
+    """
+    Accumulates streamed chunks as a queue of segments instead of one ever-growing string.
+
+    `str += chunk` and `str[n:]` copy the whole buffer on every token, which turns long responses (JSON or table
+    dumps) into quadratic copying. Here appending costs at most one bounded segment copy, consuming drops whole
+    segments or moves an offset into the first one, and text is only materialized by `peek` for the window that is
+    about to be analyzed.
+    """
+
+    # Small chunks are coalesced up to this size, so per-segment overhead stays low for token-sized chunks while
+    # every copy stays bounded.
+    _SEGMENT_SIZE = 256
+
+    def __init__(self):
+        self._segments: deque[str] = deque()
+        # Number of characters of `_segments[0]` that were already consumed
+        self._offset = 0
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __str__(self) -> str:
+        return self.peek()
+
+    def append(self, chunk: str):
+        if not chunk:
+            return
+        if self._segments and len(self._segments[-1]) + len(chunk) <= self._SEGMENT_SIZE:
+            self._segments[-1] += chunk
+        else:
+            self._segments.append(chunk)
+        self._length += len(chunk)
+
+    def peek(self, size: int | None = None) -> str:
+        """Return the first `size` characters (the whole buffer by default) without consuming them."""
+        if size is None or size > self._length:
+            size = self._length
+        parts = []
+        offset = self._offset
+        for segment in self._segments:
+            if size <= 0:
+                break
+            part = segment[offset:offset + size]
+            parts.append(part)
+            size -= len(part)
+            offset = 0
+        return ''.join(parts)
+
+    def consume(self, size: int):
+        """Drop the first `size` characters."""
+        size = max(0, min(size, self._length))
+        self._length -= size
+        while size > 0:
+            remaining = len(self._segments[0]) - self._offset
+            if size < remaining:
+                self._offset += size
+                return
+            self._segments.popleft()
+            self._offset = 0
+            size -= remaining
+
+    def clear(self):
+        self._segments.clear()
+        self._offset = 0
+        self._length = 0
+
+
+class AdaptiveFlushPolicy:
+    """
+    Flush threshold and margin that follow the stream instead of a fixed `buffer_size`/`safety_margin`.
+
+    The threshold is the number of characters expected within `target_delay_ms` at the observed chunk arrival rate
+    (exponentially weighted, `smoothing` is the weight of the newest chunk), clamped to
+    [`min_buffer_size`, `max_buffer_size`]: a slow stream is flushed after a few characters, a fast one in larger
+    windows that are cheaper to analyze, both with about the same added delay. Until the rate is known the threshold
+    is `min_buffer_size`, so the first words aren't held for long.
+
+    The margin is the live partial-match holdback (the tail that could still grow into PII, see
+    `StreamingPartialMatcher`) plus `min_safety_margin`, instead of the larger of a fixed margin and the holdback. The
+    regex patterns are fully covered by the partial matcher, Presidio's NER needs some right context: use a
+    `min_safety_margin` of a few words there.
+
+    Keeps per-stream state, use one policy per guardrail.
+    """
+
+    def __init__(
+            self,
+            min_buffer_size: int = 16,
+            max_buffer_size: int = 200,
+            target_delay_ms: float = 100.0,
+            min_safety_margin: int = 0,
+            smoothing: float = 0.3,
+    ):
+        self.min_buffer_size = min_buffer_size
+        self.max_buffer_size = max_buffer_size
+        self.target_delay_ms = target_delay_ms
+        self.min_safety_margin = min_safety_margin
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        """Forget the arrival rate, e.g. between two responses."""
+        self._last_arrival: float | None = None
+        # Smoothed chunk size (chars) and gap between chunks (seconds)
+        self._chunk_size: float | None = None
+        self._interval: float | None = None
+
+    def observe(self, size: int):
+        """Account for a chunk of `size` characters arriving now."""
+        now = time.perf_counter()
+        if self._last_arrival is not None:
+            interval = now - self._last_arrival
+            if self._interval is None:
+                self._chunk_size, self._interval = size, interval
+            else:
+                self._chunk_size += self.smoothing * (size - self._chunk_size)
+                self._interval += self.smoothing * (interval - self._interval)
+        self._last_arrival = now
+
+    @property
+    def chars_per_second(self) -> float | None:
+        if self._interval is None:
+            return None
+        return self._chunk_size / self._interval if self._interval > 0 else float("inf")
+
+    @property
+    def buffer_size(self) -> int:
+        rate = self.chars_per_second
+        if rate is None:
+            return self.min_buffer_size
+        expected = rate * self.target_delay_ms / 1000
+        return int(max(self.min_buffer_size, min(self.max_buffer_size, expected)))
+
+    def margin(self, holdback: int) -> int:
+        return holdback + self.min_safety_margin
+
+
+class _GuardrailMixin:
+    """
+    Flush policy, deadline flushes and async counterparts of `process_chunk` and `finalize`.
+
+    Without `flush_policy` the buffer is flushed past `buffer_size`, keeping the larger of `safety_margin` and the
+    partial-match holdback; with it `AdaptiveFlushPolicy` decides both. `flush_pending` releases what is safe right
+    away whatever the buffer size, for when the upstream stream stalls (see `astream_guarded`).
+
+    In the async API buffering stays on the event loop; analysis and redaction run on the bounded guardrail executor,
+    so one slow window doesn't stall the other streams served by the same loop. Calls on one guardrail are serialized
+    to keep the order of its output.
+    """
+
+    def _executor(self) -> ThreadPoolExecutor | None:
+        """Executor of the async API, None for the guardrail executor."""
+        return None
+
+    def _should_flush(self) -> bool:
+        buffer_size = self.flush_policy.buffer_size if self.flush_policy is not None else self.buffer_size
+        return len(self.buffer) > buffer_size
+
+    def _max_buffer_size(self) -> int:
+        return self.flush_policy.max_buffer_size if self.flush_policy is not None else self.buffer_size
+
+    def _margin(self, holdback: int) -> int:
+        """Trailing characters to keep in the buffer at a flush."""
+        if self.flush_policy is not None:
+            return self.flush_policy.margin(holdback)
+        return max(self.safety_margin, holdback)
+
+    def _observe(self, chunk: str):
+        if self.flush_policy is not None:
+            self.flush_policy.observe(len(chunk))
+
+    def flush_pending(self) -> str:
+        """Release the safe part of the buffer now, however small it is."""
+        if not self.buffer:
+            return ""
+        return self._flush(self._partial_matcher.holdback)
+
+    async def aprocess_chunk(self, chunk: str) -> str:
+        if not chunk:
+            return chunk
+        async with self._async_lock:
+            holdback = self._accumulate(chunk)
+            if self._should_flush():
+                return await run_cpu_bound(self._flush, holdback, executor=self._executor())
+            return ""
+
+    async def aflush_pending(self) -> str:
+        async with self._async_lock:
+            if not self.buffer:
+                return ""
+            return await run_cpu_bound(self.flush_pending, executor=self._executor())
+
+    async def afinalize(self) -> str:
+        async with self._async_lock:
+            return await run_cpu_bound(self.finalize, executor=self._executor())
+
+
+class LexicalPrefilter:
+    """
+    Cheap lexical screen that tells which entity types a window could possibly contain.
+
+    Every known entity type needs at least one signal: digits for numeric identifiers, `@` for emails, a capitalized
+    word that isn't a common sentence starter for names and places, and so on. A window with no signal for any
+    configured entity type can skip Presidio altogether, and a window whose candidates are all pattern-based can
+    skip the spaCy pipeline. Entity types without a known signal are always treated as candidates.
+    """
+
+    _SIGNALS = {
+        'digit': re.compile(r'\d'),
+        'at': re.compile(r'@'),
+        'url': re.compile(r'://|www\.|[A-Za-z0-9-]\.[A-Za-z]{2,}'),
+        'hex_pair': re.compile(r'[0-9A-Fa-f]{2}[:-][0-9A-Fa-f]{2}'),
+        # Lowercase too: "born on july third, nineteen seventy-nine" has no capitalized word or digit
+        'date_word': re.compile(
+            r'\b(?:today|tonight|yesterday|tomorrow|morning|afternoon|evening|night|noon|midnight|day|week|weekend'
+            r'|fortnight|month|quarter|year|decade|century|ago|hour|minute|o\'clock|am|pm|birthday|anniversary|holiday'
+            r'|christmas|easter|spring|summer|autumn|fall|winter|season'
+            r'|monday|tuesday|wednesday|thursday|friday|saturday|sunday|mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun'
+            r'|january|february|march|april|may|june|july|august|september|october|november|december'
+            r'|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec'
+            r'|first|second|third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|eleventh|twelfth|thirteenth'
+            r'|fourteenth|fifteenth|sixteenth|seventeenth|eighteenth|nineteenth|twentieth|thirtieth'
+            r'|thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty|hundred|thousand)s?\b',
+            re.IGNORECASE
+        ),
+    }
+
+    # Capitalized words that usually just start a sentence and say nothing about names or places
+    _SENTENCE_STARTERS = frozenset({
+        'A', 'An', 'The', 'This', 'That', 'These', 'Those', 'It', 'Its', 'I', 'We', 'You', 'Your', 'He', 'She', 'They',
+        'Their', 'There', 'Here', 'If', 'In', 'On', 'At', 'For', 'To', 'And', 'But', 'Or', 'So', 'As', 'Of', 'By',
+        'With', 'No', 'Yes', 'Please', 'Sorry', 'Sure', 'Thanks', 'Thank', 'Hello', 'Hi', 'Unfortunately', 'However',
+        'Also', 'Note', 'Feel', 'Let', 'Can', 'Could', 'Would', 'Should', 'Is', 'Are', 'Do', 'Does', 'What', 'When',
+        'Where', 'Which', 'Who', 'How', 'Why', 'My', 'Our',
+    })
+    _CAPITALIZED_WORD = re.compile(r"\b[A-Z][A-Za-z'’-]*")
+
+    _ENTITY_SIGNALS = {
+        'CREDIT_CARD': {'digit'},
+        'CRYPTO': {'digit'},
+        'IBAN_CODE': {'digit'},
+        'IP_ADDRESS': {'digit', 'hex_pair'},
+        'MAC_ADDRESS': {'digit', 'hex_pair'},
+        'MEDICAL_LICENSE': {'digit'},
+        'PHONE_NUMBER': {'digit'},
+        'UK_NHS': {'digit'},
+        'US_BANK_NUMBER': {'digit'},
+        'US_DRIVER_LICENSE': {'digit'},
+        'US_ITIN': {'digit'},
+        'US_PASSPORT': {'digit'},
+        'US_SSN': {'digit'},
+        'AGE': {'digit'},
+        'ID': {'digit'},
+        'EMAIL_ADDRESS': {'at'},
+        'EMAIL': {'at'},
+        'URL': {'url'},
+        'PERSON': {'capitalized'},
+        'LOCATION': {'capitalized'},
+        'NRP': {'capitalized'},
+        'ORGANIZATION': {'capitalized'},
+        'DATE_TIME': {'digit', 'capitalized', 'date_word'},
+    }
+
+    # Entity types the spaCy NER pipeline finds, and the signals that point at NER rather than at a pattern (a digit
+    # only hints at a numeric date, which the pattern based DateRecognizer handles)
+    NER_ENTITIES = frozenset({'PERSON', 'LOCATION', 'NRP', 'ORGANIZATION', 'DATE_TIME'})
+    _NER_SIGNALS = frozenset({'capitalized', 'date_word'})
+
+    def _has_signal(self, signal: str, text: str) -> bool:
+        if signal == 'capitalized':
+            return any(word not in self._SENTENCE_STARTERS for word in self._CAPITALIZED_WORD.findall(text))
+        return self._SIGNALS[signal].search(text) is not None
+
+    def screen(self, text: str, entities: list[str]) -> tuple[list[str], bool]:
+        """Return the entity types from `entities` that `text` could contain, and whether finding them needs NER."""
+        present = {}
+        candidates = []
+        needs_ner = False
+        for entity in entities:
+            signals = self._ENTITY_SIGNALS.get(entity)
+            if signals is None:
+                candidates.append(entity)
+                needs_ner = needs_ner or entity in self.NER_ENTITIES
+                continue
+            matched = False
+            for signal in signals:
+                if signal not in present:
+                    present[signal] = self._has_signal(signal, text)
+                if present[signal]:
+                    matched = True
+                    if entity in self.NER_ENTITIES and signal in self._NER_SIGNALS:
+                        needs_ner = True
+            if matched:
+                candidates.append(entity)
+        return candidates, needs_ner
+
+
+class PresidioStreamingPIIGuardrail(_GuardrailMixin):
+    """
+    Streaming guardrail that anonymizes PII with Presidio (NER + pattern recognizers) window by window.
+
+    With `incremental=True` every window is analyzed together with the last `context_overlap` characters of already
+    emitted text, so an entity split across the cut still gets its left context. Spans that start in that context are
+    carried over and anonymized in the new text, spans that touch the end of the window are held back for the next
+    one, and spans that lie entirely in the context are not anonymized twice. Cuts are also kept out of trailing
+    partial matches (see `StreamingPartialMatcher`) and made on whitespace only.
 
+    With `prefilter=True` every window first goes through `LexicalPrefilter`: windows that can't contain any of the
+    configured `entities` are not analyzed at all, and windows that can only contain pattern-based entities skip
+    spaCy. `prefilter_stats` reports how many windows took each path.
 
-class PresidioStreamingPIIGuardrail:
+    With `analysis_pool` (see `presidio_pool.PresidioWorkerPool`) analysis runs in worker processes instead of this
+    one; anonymization and all streaming state stay here.
+    """
 
-    def __init__(self, buffer_size: int =100, safety_margin: int = 20):
+    def __init__(
+            self,
+            buffer_size: int =100,
+            safety_margin: int = 20,
+            nlp_configuration: dict | None = None,
+            incremental: bool = False,
+            context_overlap: int = 30,
+            entities: list[str] | None = None,
+            prefilter: bool = True,
+            analysis_pool: PresidioWorkerPool | None = None,
+            flush_policy: AdaptiveFlushPolicy | None = None,
+    ):
         #TODO:
-        # 1. Create dict with language configurations: {"nlp_engine_name": "spacy","models": [{"lang_code": "en", "model_name": "en_core_web_sm"}]}
-        #    Read more about it here: https://microsoft.github.io/presidio/tutorial/05_languages/
-        configuration = {"nlp_engine_name": "spacy","models": [{"lang_code": "en", "model_name": "en_core_web_sm"}]}
-        # 2. Create NlpEngineProvider with created configurations
-        provider = NlpEngineProvider(nlp_configuration=configuration)
-        # 3. Create AnalyzerEngine, as `nlp_engine` crate engine by crated provider (will be used as obj var later)
-
-        self.analyzer = AnalyzerEngine(
-            nlp_engine=provider.create_engine()
-        )
-        # 4. Create AnonymizerEngine (will be used as obj var later)
-        self.anonymizer = AnonymizerEngine()
-        # 5. Create buffer as empty string (here we will accumulate chunks content and process it, will be used as obj var late)
-        self.buffer = ''
-        # 6. Create buffer_size as `buffer_size` (will be used as obj var late)
+        # 1. Keep NLP configuration (defaults to spaCy `en_core_web_sm`), see `presidio_engines.DEFAULT_NLP_CONFIGURATION`
+        self.nlp_configuration = nlp_configuration
+        # 2. Analyzer and anonymizer are not created here: they are shared process-wide and loaded on first use
+        #    (see `analyzer` and `anonymizer` properties), so creating a guardrail per chat session is cheap
+        # 3. Create buffer (here we will accumulate chunks content and process it, will be used as obj var late)
+        self.buffer = ChunkBuffer()
+        # 4. Create buffer_size as `buffer_size` (will be used as obj var late)
         self.buffer_size = buffer_size
-        # 7. Create safety_margin as `safety_margin` (will be used as obj var late)
+        # 5. Create safety_margin as `safety_margin` (will be used as obj var late)
         self.safety_margin = safety_margin
+        self.incremental = incremental
+        self.context_overlap = context_overlap
+        # Tail of already analyzed and emitted raw text, used as left context in incremental mode
+        self._context = ''
+        # Holds back trailing digit runs and unfinished words that may still grow into an entity
+        self._partial_matcher = StreamingPartialMatcher()
+        # Entity types to look for, all supported by the analyzer by default (resolved on first analysis)
+        self.entities = entities
+        self.prefilter = LexicalPrefilter() if prefilter else None
+        self.prefilter_stats = {'windows': 0, 'skipped': 0, 'pattern_only': 0, 'full': 0}
+        # Optional multi-process backend: windows are analyzed (and batched with other sessions) in worker processes
+        self.analysis_pool = analysis_pool
+        # Optional adaptive flush threshold and margin instead of `buffer_size`/`safety_margin`
+        self.flush_policy = flush_policy
+        self._async_lock = asyncio.Lock()
+        self._holdback_tracker = HoldbackTracker()
+
+    def _executor(self) -> ThreadPoolExecutor | None:
+        # With a worker pool, flushes mostly wait for it: don't let them take up the CPU-sized guardrail executor
+        return self.analysis_pool.caller_executor if self.analysis_pool is not None else None
+
+    @property
+    def analyzer(self) -> "AnalyzerEngine":
+        return get_analyzer(self.nlp_configuration)
+
+    @property
+    def anonymizer(self) -> "AnonymizerEngine":
+        return get_anonymizer()
+
+    @property
+    def skipped_nlp_ratio(self) -> float:
+        """Fraction of analyzed windows that didn't go through the spaCy pipeline."""
+        stats = self.prefilter_stats
+        return (stats['skipped'] + stats['pattern_only']) / stats['windows'] if stats['windows'] else 0.0
+
+    def _analyze(self, text: str) -> list["RecognizerResult"]:
+        if self.entities is None:
+            self.entities = (
+                self.analysis_pool.get_supported_entities() if self.analysis_pool
+                else self.analyzer.get_supported_entities(language="en")
+            )
+        if self.prefilter is None:
+            return self._run_analyzer(text, self.entities, needs_ner=True)
+
+        self.prefilter_stats['windows'] += 1
+        candidates, needs_ner = self.prefilter.screen(text, self.entities)
+        if not candidates:
+            self.prefilter_stats['skipped'] += 1
+            return []
+        self.prefilter_stats['full' if needs_ner else 'pattern_only'] += 1
+        return self._run_analyzer(text, candidates, needs_ner)
+
+    @timed("presidio.analyze")
+    def _run_analyzer(self, text: str, entities: list[str], needs_ner: bool) -> list["RecognizerResult"]:
+        if self.analysis_pool is not None:
+            return self.analysis_pool.analyze(text, entities, needs_ner)
+        if not needs_ner:
+            from presidio_analyzer.nlp_engine import NlpArtifacts
+
+            # Empty NLP artifacts make the analyzer skip spaCy; pattern recognizers only lose context word boosts
+            nlp_artifacts = NlpArtifacts(
+                entities=[], tokens=[], tokens_indices=[], lemmas=[], nlp_engine=None, language="en"
+            )
+            return self.analyzer.analyze(text=text, language="en", entities=entities, nlp_artifacts=nlp_artifacts)
+        return self.analyzer.analyze(text=text, language="en", entities=entities)
+
+    @timed("presidio.anonymize")
+    def _anonymize(self, text: str, results: list["RecognizerResult"]) -> str:
+        return self.anonymizer.anonymize(text=text, analyzer_results=results).text
 
     def process_chunk(self, chunk: str) -> str:
         #TODO:
@@ -38,48 +485,193 @@ class PresidioStreamingPIIGuardrail:
         if not chunk:
             return chunk
         # 2. Accumulate chunk to `buffer`
-        self.buffer += chunk
+        holdback = self._accumulate(chunk)
+        # 3. Once `buffer` outgrows `buffer_size` (or the flush policy's threshold), anonymize and return its safe part
+        if self._should_flush():
+            return self._flush(holdback)
 
-        if len(self.buffer) > self.buffer_size:
-            safe_length = len(self.buffer) - self.safety_margin
-            for i in range(safe_length - 1, max(0, safe_length - 20), -1):
-                if self.buffer[i] in ' \n\t.,;:!?':
-                    safe_length = i
-                    break
+        return ""
 
-            text_to_process = self.buffer[:safe_length]
+    def _accumulate(self, chunk: str) -> int:
+        """Append `chunk` to `buffer` and return how many trailing characters must be held back."""
+        self.buffer.append(chunk)
+        self._holdback_tracker.arrived(len(chunk))
+        self._observe(chunk)
+        return self._partial_matcher.feed(chunk) if self.incremental else 0
+
+    @_guardrail_stage("guardrail.flush")
+    def _flush(self, holdback: int) -> str:
+        """Analyze and anonymize the safe part of `buffer`, drop it from `buffer` and return it."""
+        safe_length = len(self.buffer) - self._margin(holdback)
+        if safe_length <= 0:
+            return ""
+        # One character past the cut, so a cut can see what follows it
+        window = self.buffer.peek(safe_length + 1)
+        # Early flushes (adaptive threshold, deadline) only cut at whitespace; past the hard limit the cut falls back
+        # to `safe_length`, so the buffer can't grow without bound
+        forced = len(self.buffer) > self._max_buffer_size()
+        if self.incremental:
+            safe_length = self._find_incremental_cut(window, safe_length, fallback=forced)
+        else:
+            cut = safe_length if forced else 0
+            separators = ' \n\t.,;:!?' if forced else ' \n\t'
+            for i in range(safe_length - 1, max(0, safe_length - 20) if forced else 0, -1):
+                if window[i] in separators:
+                    cut = i
+                    break
+            safe_length = cut
+        if safe_length <= 0:
+            return ""
 
-            #TODO:
-            # 1. Get results with analyzer by method analyze, text is `text_to_process`, language is 'en'
-            results = self.analyzer.analyze(text=text_to_process, language="en")
-            # 2. Anonymize content, use anonymizer method anonymize with such params:
-            #       - text=text_to_process
-            #       - analyzer_results=results
-            anonymized = self.anonymizer.anonymize(text=text_to_process, analyzer_results=results)
-            # 3. Set `buffer` as `buffer[safe_length:]`
-            self.buffer = self.buffer[safe_length:]
-            # 4. Return anonymized text
-            return anonymized.text
+        text_to_process = window[:safe_length]
 
-        return ""
+        if self.incremental:
+            anonymized_text, processed_length = self._process_incrementally(text_to_process, final=False)
+            self.buffer.consume(processed_length)
+            return anonymized_text
 
+        #TODO:
+        # 1. Get results with analyzer by method analyze (behind the lexical prefilter), text is `text_to_process`,
+        #    language is 'en'
+        results = self._analyze(text_to_process)
+        # 2. Anonymize content, use anonymizer method anonymize with such params:
+        #       - text=text_to_process
+        #       - analyzer_results=results
+        anonymized_text = self._anonymize(text_to_process, results)
+        # 3. Drop processed `safe_length` characters from `buffer`
+        self.buffer.consume(safe_length)
+        # 4. Return anonymized text
+        return anonymized_text
+
+    @_guardrail_stage("guardrail.finalize")
     def finalize(self) -> str:
+        if self.flush_policy is not None:
+            self.flush_policy.reset()
         #TODO:
         # 1. Check if `buffer` is present, otherwise return empty string
         if not self.buffer:
             return ''
 
+        text = self.buffer.peek()
+        if self.incremental:
+            anonymized_text, _ = self._process_incrementally(text, final=True)
+            self.buffer.clear()
+            self._context = ''
+            self._partial_matcher.reset()
+            return anonymized_text
+
         # 2. Analyze `buffer`
-        results = self.analyzer.analyze(text=self.buffer, language="en")
+        results = self._analyze(text)
         # 3. Anonymize `buffer` with analyzed results
-        anonymized = self.anonymizer.anonymize(text=self.buffer, analyzer_results=results)
-        # 4. Set `buffer` as empty string
-        self.buffer = ''
+        anonymized_text = self._anonymize(text, results)
+        # 4. Clear `buffer`
+        self.buffer.clear()
         # 5. Return anonymized text
-        return anonymized.text
+        return anonymized_text
+
+    @staticmethod
+    def _find_incremental_cut(window: str, safe_length: int, fallback: bool = True) -> int:
+        """
+        Find the last whitespace before `safe_length` that doesn't split a grouped number ("4111 1111", "(206) 555").
+
+        Cutting on whitespace only keeps emails, URLs and dotted numbers whole. Falls back to `safe_length` (0 without
+        `fallback`).
+        """
+        for i in range(safe_length - 1, 0, -1):
+            if window[i] not in ' \n\t':
+                continue
+            if window[i - 1] in '0123456789)' and i + 1 < len(window) and window[i + 1] in '0123456789(':
+                continue
+            return i
+        return safe_length if fallback else 0
+
+    def _process_incrementally(self, text_to_process: str, final: bool) -> tuple[str, int]:
+        """
+        Analyze `text_to_process` with the carried left context and anonymize it.
+
+        Returns the anonymized text and how many characters of `text_to_process` it covers: unless `final`, an entity
+        that reaches the end of the window may continue in the next chunk, so it is left in the buffer.
+        """
+        from presidio_analyzer import RecognizerResult
+
+        offset = len(self._context)
+        text = self._context + text_to_process
+        results = self._analyze(text)
+
+        processed_length = len(text_to_process)
+        if not final:
+            for result in results:
+                if result.end >= len(text) and result.start >= offset:
+                    processed_length = min(processed_length, result.start - offset)
+
+        shifted_results = []
+        for result in results:
+            start = max(result.start - offset, 0)
+            end = min(result.end - offset, processed_length)
+            if start < end:
+                shifted_results.append(
+                    RecognizerResult(entity_type=result.entity_type, start=start, end=end, score=result.score)
+                )
+
+        processed_text = text_to_process[:processed_length]
+        if self.context_overlap > 0:
+            self._context = (self._context + processed_text)[-self.context_overlap:]
+        if not processed_text:
+            return '', 0
+
+        return self._anonymize(processed_text, shifted_results), processed_length
+
+
+class StreamingPartialMatcher:
+    """
+    Tracks, across chunks, the trailing text that could still grow into PII.
+
+    Every partial pattern describes a prefix of some entity matched by `StreamingPIIGuardrail` and is anchored at the
+    end of the stream. The patterns are prefix-closed (any prefix of a partial match, starting at the same position,
+    is itself a partial match), so a match that is live after a new chunk can only start inside the previously live
+    tail or inside the new chunk. The matcher therefore keeps just that tail and rescans it, instead of rerunning
+    every pattern over the whole buffer at every candidate cut.
+    """
+
+    _PARTIAL_PATTERNS = [
+        r'\w+$',  # Unfinished word (month names, license prefixes, CVV/Exp labels, ...)
+        r'\d[\d\s\-/.,()]*$',  # Run of digits and separators (SSN, credit card, phone, account, numeric dates)
+        r'\$[\d,]*\.?\d*$',  # Partial currency
+        r'[A-Z]{1,2}(?:-(?:D(?:L(?:-[A-Z0-9]*)?)?)?)?$',  # Partial license
+        r'(?:January|February|March|April|May|June|July|August|September|October|November|December)\s*\d{0,2},?\s*\d{0,4}$',  # Partial date
+        r'CVV["\']?\s*:?\s*["\']?\s*\d{0,4}$',  # Partial CVV
+        r'Exp(?:iry)?["\']?\s*:?\s*["\']?\s*\d{0,2}/?\d{0,2}$',  # Partial expiry
+        r'\d+\s+[A-Za-z\s]*$',  # Partial address
+        r'Bank\s*(?:of?\s*(?:\w+[-\s]*\d*)?)?$',  # Bank name that may prefix an account number
+    ]
+
+    # Leftmost match of the alternation == earliest start of any live partial match.
+    _PARTIAL_SCANNER = re.compile('|'.join(f'(?:{pattern})' for pattern in _PARTIAL_PATTERNS), re.IGNORECASE)
+
+    def __init__(self, max_holdback: int = 256):
+        # Upper bound on the live tail, so a pathological run (e.g. a long numeric table) can't stall the stream.
+        self.max_holdback = max_holdback
+        self._tail = ""
+
+    @property
+    def holdback(self) -> int:
+        """Number of trailing characters that must not be emitted yet."""
+        return len(self._tail)
+
+    def feed(self, chunk: str) -> int:
+        """Advance the matcher by `chunk` and return the updated holdback."""
+        text = self._tail + chunk
+        match = self._PARTIAL_SCANNER.search(text)
+        self._tail = text[match.start():] if match else ""
+        if len(self._tail) > self.max_holdback:
+            self._tail = self._tail[-self.max_holdback:]
+        return len(self._tail)
 
+    def reset(self):
+        self._tail = ""
 
-class StreamingPIIGuardrail:
+
+class StreamingPIIGuardrail(_GuardrailMixin):
     """
     A streaming guardrail that detects and redacts PII in real-time as chunks arrive from the LLM.
 
@@ -87,110 +679,140 @@ class StreamingPIIGuardrail:
     PII that might be split across chunk boundaries.
     """
 
-    def __init__(self, buffer_size: int =100, safety_margin: int = 20):
+    # Entity name -> (pattern, replacement). Order matters: when several patterns match at the same
+    # position, the one listed first wins.
+    _PII_PATTERNS = {
+        'ssn': (
+            r'\b(\d{3}[-\s]?\d{2}[-\s]?\d{4})\b',
+            '[REDACTED-SSN]'
+        ),
+        'credit_card': (
+            r'\b(?:\d{4}[-\s]?){3}\d{4}\b|\b\d{13,19}\b',
+            '[REDACTED-CREDIT-CARD]'
+        ),
+        'license': (
+            r'\b[A-Z]{2}-DL-[A-Z0-9]+\b',
+            '[REDACTED-LICENSE]'
+        ),
+        'bank_account': (
+            r'\b(?:Bank\s+of\s+\w+\s*[-\s]*)?(?<!\d)(\d{10,12})(?!\d)\b',
+            '[REDACTED-ACCOUNT]'
+        ),
+        'date': (
+            r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}\b|\b\d{1,2}/\d{1,2}/\d{4}\b|\b\d{4}-\d{2}-\d{2}\b',
+            '[REDACTED-DATE]'
+        ),
+        'cvv': (
+            r'(?:CVV:?\s*|CVV["\']\s*:\s*["\']\s*)(\d{3,4})',
+            r'CVV: [REDACTED]'
+        ),
+        'card_exp': (
+            r'(?:Exp(?:iry)?:?\s*|Expiry["\']\s*:\s*["\']\s*)(\d{2}/\d{2})',
+            r'Exp: [REDACTED]'
+        ),
+        'address': (
+            r'\b(\d+\s+[A-Za-z\s]+(?:Street|St\.?|Avenue|Ave\.?|Boulevard|Blvd\.?|Road|Rd\.?|Drive|Dr\.?|Lane|Ln\.?|Way|Circle|Cir\.?|Court|Ct\.?|Place|Pl\.?))\b',
+            '[REDACTED-ADDRESS]'
+        ),
+        'currency': (
+            r'\$[\d,]+\.?\d*',
+            '[REDACTED-AMOUNT]'
+        )
+    }
+
+    # All patterns joined into one named-group alternation, so a single left-to-right pass finds every entity.
+    _PII_SCANNER = re.compile(
+        '|'.join(f'(?P<{name}>{pattern})' for name, (pattern, _) in _PII_PATTERNS.items()),
+        re.IGNORECASE | re.MULTILINE
+    )
+
+    def __init__(
+            self,
+            buffer_size: int =100,
+            safety_margin: int = 20,
+            flush_policy: AdaptiveFlushPolicy | None = None,
+    ):
         self.buffer_size = buffer_size
         self.safety_margin = safety_margin
-        self.buffer = ""
-
-    @property
-    def _pii_patterns(self):
-        return {
-            'ssn': (
-                r'\b(\d{3}[-\s]?\d{2}[-\s]?\d{4})\b',
-                '[REDACTED-SSN]'
-            ),
-            'credit_card': (
-                r'\b(?:\d{4}[-\s]?){3}\d{4}\b|\b\d{13,19}\b',
-                '[REDACTED-CREDIT-CARD]'
-            ),
-            'license': (
-                r'\b[A-Z]{2}-DL-[A-Z0-9]+\b',
-                '[REDACTED-LICENSE]'
-            ),
-            'bank_account': (
-                r'\b(?:Bank\s+of\s+\w+\s*[-\s]*)?(?<!\d)(\d{10,12})(?!\d)\b',
-                '[REDACTED-ACCOUNT]'
-            ),
-            'date': (
-                r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{4}\b|\b\d{1,2}/\d{1,2}/\d{4}\b|\b\d{4}-\d{2}-\d{2}\b',
-                '[REDACTED-DATE]'
-            ),
-            'cvv': (
-                r'(?:CVV:?\s*|CVV["\']\s*:\s*["\']\s*)(\d{3,4})',
-                r'CVV: [REDACTED]'
-            ),
-            'card_exp': (
-                r'(?:Exp(?:iry)?:?\s*|Expiry["\']\s*:\s*["\']\s*)(\d{2}/\d{2})',
-                r'Exp: [REDACTED]'
-            ),
-            'address': (
-                r'\b(\d+\s+[A-Za-z\s]+(?:Street|St\.?|Avenue|Ave\.?|Boulevard|Blvd\.?|Road|Rd\.?|Drive|Dr\.?|Lane|Ln\.?|Way|Circle|Cir\.?|Court|Ct\.?|Place|Pl\.?))\b',
-                '[REDACTED-ADDRESS]'
-            ),
-            'currency': (
-                r'\$[\d,]+\.?\d*',
-                '[REDACTED-AMOUNT]'
-            )
-        }
-
-    def _detect_and_redact_pii(self, text: str) -> str:
-        """Apply all PII patterns to redact sensitive information."""
-        cleaned_text = text
-        for pattern_name, (pattern, replacement) in self._pii_patterns.items():
-            if pattern_name.lower() in ['cvv', 'card_exp']:
-                cleaned_text = re.sub(pattern, replacement, cleaned_text, flags=re.IGNORECASE | re.MULTILINE)
-            else:
-                cleaned_text = re.sub(pattern, replacement, cleaned_text, flags=re.IGNORECASE | re.MULTILINE)
-        return cleaned_text
-
-    def _has_potential_pii_at_end(self, text: str) -> bool:
-        """Check if text ends with a partial pattern that might be PII."""
-        partial_patterns = [
-            r'\d{3}[-\s]?\d{0,2}$',  # Partial SSN
-            r'\d{4}[-\s]?\d{0,4}$',  # Partial credit card
-            r'[A-Z]{1,2}-?D?L?-?[A-Z0-9]*$',  # Partial license
-            r'\(?\d{0,3}\)?[-.\s]?\d{0,3}$',  # Partial phone
-            r'\$[\d,]*\.?\d*$',  # Partial currency
-            r'\b\d{1,4}/\d{0,2}$',  # Partial date
-            r'CVV:?\s*\d{0,3}$',  # Partial CVV
-            r'Exp(?:iry)?:?\s*\d{0,2}$',  # Partial expiry
-            r'\d+\s+[A-Za-z\s]*$',  # Partial address
-        ]
-
-        for pattern in partial_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return True
-        return False
+        self.flush_policy = flush_policy
+        self.buffer = ChunkBuffer()
+        self._partial_matcher = StreamingPartialMatcher()
+        self._async_lock = asyncio.Lock()
+        self._holdback_tracker = HoldbackTracker()
+
+    @classmethod
+    def find_pii_spans(cls, text: str) -> list[tuple[int, int, str]]:
+        """Return non-overlapping `(start, end, entity)` spans of all PII found in `text`, left to right."""
+        return [(match.start(), match.end(), match.lastgroup) for match in cls._PII_SCANNER.finditer(text)]
+
+    def _detect_and_redact_pii(self, text: str, matches: list[re.Match] | None = None) -> str:
+        """Redact all PII in one scan, rebuilding the string once. `matches` may carry an already done scan."""
+        if matches is None:
+            matches = self._PII_SCANNER.finditer(text)
+        parts = []
+        last_end = 0
+        for match in matches:
+            parts.append(text[last_end:match.start()])
+            parts.append(self._PII_PATTERNS[match.lastgroup][1])
+            last_end = match.end()
+        if not parts:
+            return text
+        parts.append(text[last_end:])
+        return ''.join(parts)
 
     def process_chunk(self, chunk: str) -> str:
         """Process a streaming chunk and return safe content that can be immediately output."""
         if not chunk:
             return chunk
 
-        self.buffer += chunk
+        holdback = self._accumulate(chunk)
 
-        if len(self.buffer) > self.buffer_size:
-            safe_output_length = len(self.buffer) - self.safety_margin
-
-            for i in range(safe_output_length - 1, max(0, safe_output_length - 20), -1):
-                if self.buffer[i] in ' \n\t.,;:!?':
-                    test_text = self.buffer[:i]
-                    if not self._has_potential_pii_at_end(test_text):
-                        safe_output_length = i
-                        break
-
-            text_to_output = self.buffer[:safe_output_length]
-            safe_output = self._detect_and_redact_pii(text_to_output)
-            self.buffer = self.buffer[safe_output_length:]
-            return safe_output
+        if self._should_flush():
+            return self._flush(holdback)
 
         return ""
 
+    def _accumulate(self, chunk: str) -> int:
+        """Append `chunk` to the buffer and return how many trailing characters must be held back."""
+        self.buffer.append(chunk)
+        self._holdback_tracker.arrived(len(chunk))
+        self._observe(chunk)
+        return self._partial_matcher.feed(chunk)
+
+    @_guardrail_stage("guardrail.flush")
+    def _flush(self, holdback: int) -> str:
+        """Redact the safe part of the buffer, drop it from the buffer and return it."""
+        safe_output_length = len(self.buffer) - self._margin(holdback)
+
+        # The partial matcher covers entities that are still growing; a finished entity may still straddle
+        # the cut, in which case the cut moves back to its start.
+        window = self.buffer.peek()
+        matches = []
+        for match in self._PII_SCANNER.finditer(window):
+            if match.start() >= safe_output_length:
+                break
+            if match.end() > safe_output_length:
+                safe_output_length = match.start()
+                break
+            matches.append(match)
+
+        if safe_output_length <= 0:
+            return ""
+
+        text_to_output = window[:safe_output_length]
+        safe_output = self._detect_and_redact_pii(text_to_output, matches)
+        self.buffer.consume(safe_output_length)
+        return safe_output
+
+    @_guardrail_stage("guardrail.finalize")
     def finalize(self) -> str:
         """Process any remaining content in the buffer at the end of streaming."""
+        if self.flush_policy is not None:
+            self.flush_policy.reset()
         if self.buffer:
-            final_output = self._detect_and_redact_pii(self.buffer)
-            self.buffer = ""
+            final_output = self._detect_and_redact_pii(self.buffer.peek())
+            self.buffer.clear()
+            self._partial_matcher.reset()
             return final_output
         return ""
 
@@ -214,26 +836,75 @@ PROFILE = """
 """
 
 #TODO:
-# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models)
-llm_client = AzureChatOpenAI(
-    temperature=0.0,
-    azure_deployment='gpt-4.1-nano-2025-04-14',
-    azure_endpoint=DIAL_URL,
-    api_key=SecretStr(API_KEY),
-    api_version=""
-)
+# Create AzureChatOpenAI client, model to use `gpt-4.1-nano-2025-04-14` (or any other mini or nano models).
+# The client is created on first use by `tasks._llm.get_llm_client`, so importing this module stays cheap.
+
+
+async def astream_guarded(
+        llm_client: "BaseChatModel",
+        messages: list[BaseMessage],
+        guardrail: PresidioStreamingPIIGuardrail | StreamingPIIGuardrail,
+        flush_deadline_ms: float | None = None,
+) -> AsyncIterator[str]:
+    """
+    Stream `llm_client` response to `messages` through `guardrail`, yielding only already guarded text.
+
+    With `flush_deadline_ms`, when no chunk arrives for that long the safe part of the buffer is released
+    (`flush_pending`) instead of waiting for the next chunk or the end of the stream.
+    """
+    started = time.perf_counter()
+    first_safe_token = True
+    deadline = flush_deadline_ms / 1000 if flush_deadline_ms is not None else None
+    chunks = aiter(llm_client.astream(messages))
+    next_chunk = asyncio.ensure_future(anext(chunks))
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_chunk}, timeout=deadline)
+            if done:
+                try:
+                    chunk = next_chunk.result()
+                except StopAsyncIteration:
+                    break
+                next_chunk = asyncio.ensure_future(anext(chunks))
+                safe_chunk = await guardrail.aprocess_chunk(chunk.content) if chunk.content else ""
+            else:
+                safe_chunk = await guardrail.aflush_pending()
+                if not safe_chunk:
+                    # Nothing more can be released before the next chunk, stop polling until it comes
+                    await asyncio.wait({next_chunk})
+            if safe_chunk:
+                if first_safe_token:
+                    record("stream.time_to_first_safe_token", time.perf_counter() - started)
+                    first_safe_token = False
+                yield safe_chunk
+    finally:
+        # The pending read has to finish before the stream can be closed
+        next_chunk.cancel()
+        await asyncio.wait({next_chunk})
+        await chunks.aclose()
+    final_chunk = await guardrail.afinalize()
+    if final_chunk:
+        if first_safe_token:
+            record("stream.time_to_first_safe_token", time.perf_counter() - started)
+        yield final_chunk
 
 
 def main():
     #TODO:
-    # 1. Create PresidioStreamingPIIGuardrail or StreamingPIIGuardrail
-    guardrail = PresidioStreamingPIIGuardrail(buffer_size=50)
-    # guardrail = StreamingPIIGuardrail(buffer_size=50)
-
-    # 2. Create list of messages with system prompt and profile
-    messages = [
+    # 1. Create PresidioStreamingPIIGuardrail or StreamingPIIGuardrail (load Presidio engines upfront, not on the
+    #    first answer)
+    warm_up()
+    #    Windows follow the stream rate (see `AdaptiveFlushPolicy`): short ones while the model is slow, up to 100 chars
+    guardrail = PresidioStreamingPIIGuardrail(
+        incremental=True, flush_policy=AdaptiveFlushPolicy(max_buffer_size=100, min_safety_margin=20)
+    )
+    # guardrail = StreamingPIIGuardrail(flush_policy=AdaptiveFlushPolicy(max_buffer_size=100))
+
+    # 2. Create history with system prompt and profile pinned (older turns are compressed or dropped once the prompt
+    #    outgrows its token budget)
+    history = ConversationHistory([
         SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=PROFILE)
-    ]
+    ])
     # 3. Create console chat with LLM, preserve history there and while streaming filter content with streaming guardrail
     print("\nTry these PII-leaking queries:")
     print("1. Please create a JSON object with Amanda Grace Johnson's information, including all available fields")
@@ -246,7 +917,7 @@ def main():
             print("Exiting the chat. Goodbye!")
             break
 
-        messages.append(HumanMessage(content=user_input))
+        history.append(HumanMessage(content=user_input))
         print("\nAI: \n", end="", flush=True)
 
         full_response = ""
@@ -254,7 +925,7 @@ def main():
     #    - For each chunk with content, call `guardrail.process_chunk(chunk.content)`
     #    - If safe_chunk is returned, print it without newline and flush, add to `full_response`
         try:
-            for chunk in llm_client.stream(messages):
+            for chunk in get_llm_client().stream(history.window()):
                 if chunk.content:
                     safe_chunk = guardrail.process_chunk(chunk.content)
                     if safe_chunk:
@@ -268,7 +939,7 @@ def main():
                 full_response += final_chunk
 
         # 7. Add AIMessage with `full_response` content to messages
-            messages.append(AIMessage(content=full_response))
+            history.append(AIMessage(content=full_response))
             full_response = ''
             print('\n')
 